@@ -1,13 +1,29 @@
+import asyncio
+import functools
+import hashlib
 import logging
 import os
 import re
+import time
+from collections import OrderedDict, defaultdict
 from app.core.config import settings
 from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
+try:
+    # Opcional: o re2 (DFA) varre as introduções em tempo linear, sem backtracking sobre o HTML
+    import re2 as _intro_re_engine
+except ImportError:
+    _intro_re_engine = re
+
 logger = logging.getLogger(__name__)
 
+GEMINI_MODEL = "gemini-2.5-pro"
+DEFAULT_TEMPERATURE = 0.7
+
 # Mapeia os tipos de seção para seus respectivos arquivos de prompt
 PROMPT_FILES = {
     "overview": "sections/overview_prompt.txt",
@@ -19,8 +35,55 @@ PROMPT_FILES = {
     "conclusion": "sections/conclusion_prompt.txt",
 }
 
+# Turno do usuário com toda a parte dinâmica do prompt. As instruções de cada seção
+# seguem como system instruction e não contêm variáveis, formando um prefixo idêntico
+# entre alunos que o Gemini pode reaproveitar via cache implícito de contexto.
+USER_DATA_TEMPLATE = "**NOME DO ALUNO:** {student_name}\n\n**DADOS DO ALUNO PARA ANÁLISE:**\n{context_data}"
+
+# Limita as chamadas simultâneas ao Gemini (geração em massa dispara várias seções de vários alunos ao mesmo tempo)
+_llm_semaphore = asyncio.Semaphore(max(1, settings.LLM_MAX_CONCURRENCY))
+
+# Cache local das seções já geradas: (expira_em, conteúdo), indexado pelo hash do prompt renderizado
+_section_cache: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+_SECTION_CACHE_MAX_ENTRIES = 10_000
+
+# Tokens consumidos por seção (entrada, parte da entrada servida do cache implícito do Gemini e saída)
+_token_usage: "defaultdict[str, dict[str, int]]" = defaultdict(lambda: {"calls": 0, "input": 0, "cached_input": 0, "output": 0})
+_USAGE_LOG_EVERY = 20
+
+class TokenUsageCallbackHandler(BaseCallbackHandler):
+    """Acumula o uso de tokens informado pelo Gemini para uma seção, incluindo os tokens lidos do cache."""
+
+    run_inline = True
+
+    def __init__(self, section_type: str):
+        self.section_type = section_type
+
+    def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    _record_token_usage(self.section_type, usage)
+
+def _record_token_usage(section_type: str, usage: dict) -> None:
+    """Soma o uso de uma chamada ao total da seção e, periodicamente, registra a taxa de acerto do cache."""
+    totals = _token_usage[section_type]
+    totals["calls"] += 1
+    totals["input"] += usage.get("input_tokens", 0)
+    totals["cached_input"] += (usage.get("input_token_details") or {}).get("cache_read", 0)
+    totals["output"] += usage.get("output_tokens", 0)
+
+    if totals["calls"] % _USAGE_LOG_EVERY == 0:
+        cache_ratio = totals["cached_input"] / totals["input"] if totals["input"] else 0
+        logger.info(
+            "Uso de tokens da seção '%s' após %d chamadas: entrada=%d (cache=%d, %.0f%%), saída=%d",
+            section_type, totals["calls"], totals["input"], totals["cached_input"], cache_ratio * 100, totals["output"],
+        )
+
+@functools.lru_cache(maxsize=32)
 def _load_prompt_template(section_type: str) -> str:
-    """Carrega o template de prompt do arquivo correspondente."""
+    """Carrega o template de prompt do arquivo correspondente (lido do disco uma única vez por processo)."""
     prompt_file = PROMPT_FILES.get(section_type)
     if not prompt_file:
         raise ValueError(f"Tipo de seção inválido: {section_type}")
@@ -32,30 +95,107 @@ def _load_prompt_template(section_type: str) -> str:
         with open(file_path, "r", encoding="utf-8") as f:
             return f.read()
     except FileNotFoundError:
-        logger.error(f"Arquivo de prompt não encontrado: {file_path}")
+        logger.error("Arquivo de prompt não encontrado: %s", file_path)
         raise
 
+@functools.lru_cache(maxsize=1)
+def prompts_digest() -> str:
+    """Hash das instruções de todas as seções; muda quando algum arquivo de prompt é editado."""
+    digest = hashlib.blake2b(digest_size=16)
+    for section_type in PROMPT_FILES:
+        digest.update(_load_prompt_template(section_type).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def section_error_html(section_type: str) -> str:
+    """Conteúdo devolvido no lugar de uma seção cuja geração falhou (o relatório é entregue assim mesmo)."""
+    return f"<p>Erro ao gerar a seção <strong>{section_type}</strong>.</p>"
+
+@functools.lru_cache(maxsize=1)
+def _get_llm() -> ChatGoogleGenerativeAI:
+    """
+    Retorna o cliente Gemini único do processo. Todas as seções compartilham o mesmo
+    cliente (e, portanto, o mesmo pool de conexões); outras temperaturas são aplicadas via bind.
+    """
+    return ChatGoogleGenerativeAI(
+        model=GEMINI_MODEL,
+        google_api_key=settings.GEMINI_API_KEY,
+        temperature=DEFAULT_TEMPERATURE,
+    )
+
+@functools.lru_cache(maxsize=32)
+def _get_prompt(section_type: str) -> ChatPromptTemplate:
+    """Monta (uma única vez) o prompt da seção: instruções estáticas primeiro, dados do aluno por último."""
+    return ChatPromptTemplate.from_messages([
+        ("system", _load_prompt_template(section_type)),
+        ("human", USER_DATA_TEMPLATE),
+    ])
+
+@functools.lru_cache(maxsize=64)
+def _get_chain(section_type: str, temperature: float = DEFAULT_TEMPERATURE):
+    """Monta (uma única vez) a cadeia de execução da seção: prompt -> modelo -> parser de saída."""
+    llm = _get_llm()
+    if temperature != DEFAULT_TEMPERATURE:
+        llm = llm.bind(temperature=temperature)
+    return _get_prompt(section_type) | llm | StrOutputParser()
+
+def _section_cache_key(section_type: str, context_data: str, student_name: str, temperature: float) -> str:
+    """Gera a chave do cache a partir de tudo que define a resposta: modelo, temperatura, seção, aluno e contexto."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (GEMINI_MODEL, repr(temperature), section_type, student_name, context_data):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def _get_cached_section(key: str) -> str | None:
+    """Retorna o conteúdo em cache para a chave, descartando entradas expiradas."""
+    entry = _section_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, content = entry
+    if expires_at < time.monotonic():
+        del _section_cache[key]
+        return None
+    _section_cache.move_to_end(key)
+    return content
+
+def _store_cached_section(key: str, content: str) -> None:
+    """Armazena o conteúdo gerado, removendo as entradas mais antigas quando o cache está cheio."""
+    if settings.REPORT_CACHE_TTL_SEC <= 0:
+        return
+    _section_cache[key] = (time.monotonic() + settings.REPORT_CACHE_TTL_SEC, content)
+    _section_cache.move_to_end(key)
+    while len(_section_cache) > _SECTION_CACHE_MAX_ENTRIES:
+        _section_cache.popitem(last=False)
+
+_MD_OPEN_RE = re.compile(r'^```html\n', re.MULTILINE)
+_MD_CLOSE_RE = re.compile(r'\n```$', re.MULTILINE)
+
+# Introduções conversacionais comuns do LLM, combinadas em uma única alternância
+COMMON_INTROS = [
+    r"Com certeza, GN Coach. Segue a análise.*?:\n+",
+    r"Com certeza. Como assistente do GN Coach,.*?:\n+",
+    r"Com base nos dados fornecidos, aqui está a análise.*?:\n+",
+    r"Análise Rápida:.*?---\n+",
+    r"BLOCO HTML DE.*?:\n+",
+]
+# Flags inline para funcionar tanto no re2 quanto no re da biblioteca padrão
+_INTRO_RE = _intro_re_engine.compile("(?is)" + "|".join(f"(?:{intro})" for intro in COMMON_INTROS))
+
+# Caracteres únicos repetidos (como 't t t t t t t') no início da saída
+_REPEAT_RE = re.compile(r'^(?:(\S)\s)\1(?:\s\1){2,}\s*\n*', re.MULTILINE)
+
 def _sanitize_html_output(raw_output: str) -> str:
     """Limpa a saída do LLM, removendo texto conversacional, blocos de código markdown e padrões repetitivos."""
-    sanitized_output = re.sub(r'^```html\n', '', raw_output, flags=re.MULTILINE)
-    sanitized_output = re.sub(r'\n```$', '', sanitized_output, flags=re.MULTILINE)
-
-    common_intros = [
-        r"Com certeza, GN Coach. Segue a análise.*?:\n+",
-        r"Com certeza. Como assistente do GN Coach,.*?:\n+",
-        r"Com base nos dados fornecidos, aqui está a análise.*?:\n+",
-        r"Análise Rápida:.*?---\n+",
-        r"BLOCO HTML DE.*?:\n+",
-    ]
-    for intro in common_intros:
-        sanitized_output = re.sub(intro, '', sanitized_output, flags=re.IGNORECASE | re.DOTALL)
-
-    # Remove repeated single characters (like 't t t t t t t') at the beginning of the output
-    sanitized_output = re.sub(r'^(?:(\S)\s)\1(?:\s\1){2,}\s*\n*', '', sanitized_output, flags=re.MULTILINE)
-
+    sanitized_output = _MD_OPEN_RE.sub('', raw_output)
+    sanitized_output = _MD_CLOSE_RE.sub('', sanitized_output)
+    sanitized_output = _INTRO_RE.sub('', sanitized_output)
+    sanitized_output = _REPEAT_RE.sub('', sanitized_output)
     return sanitized_output.strip()
 
-async def generate_report_section(section_type: str, context_data: str, student_name: str) -> str:
+async def generate_report_section(
+    section_type: str, context_data: str, student_name: str, temperature: float = DEFAULT_TEMPERATURE
+) -> str:
     """
     Gera uma seção específica do relatório usando o LLM (Google Gemini via LangChain).
 
@@ -63,40 +203,39 @@ async def generate_report_section(section_type: str, context_data: str, student_
         section_type: O tipo de seção a ser gerada (ex: 'overview').
         context_data: A string de contexto com todos os dados do aluno.
         student_name: O nome do aluno para garantir que não haja vazamento de dados.
+        temperature: A temperatura de amostragem do modelo para esta chamada.
 
     Returns:
         O conteúdo HTML gerado e sanitizado para a seção.
     """
-    logger.info(f"Gerando seção do relatório com LangChain e Gemini: {section_type} para o aluno {student_name}")
-    try:
-        prompt_template_str = _load_prompt_template(section_type)
-        
-        # Configura o modelo Gemini
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-pro",
-            google_api_key=settings.GEMINI_API_KEY,
-            temperature=0.7,
-            convert_system_message_to_human=True # Necessário para Gemini
-        )
+    logger.info("Gerando seção do relatório com LangChain e Gemini: %s para o aluno %s", section_type, student_name)
+    cache_key = _section_cache_key(section_type, context_data, student_name, temperature)
+    cached_content = _get_cached_section(cache_key)
+    if cached_content is not None:
+        logger.info("Seção '%s' reaproveitada do cache para %s.", section_type, student_name)
+        return cached_content
 
-        # Cria o prompt a partir do template
-        prompt = ChatPromptTemplate.from_template(prompt_template_str)
-
-        # Define a cadeia de execução (prompt -> modelo -> parser de saída)
-        chain = prompt | llm | StrOutputParser()
+    try:
+        # Reutiliza a cadeia (prompt -> modelo -> parser de saída) já construída para a seção
+        chain = _get_chain(section_type, temperature)
 
         # Log do contexto completo para depuração
-        logger.debug(f"Contexto completo para a seção '{section_type}':\n{context_data}")
+        logger.debug("Contexto completo para a seção '%s':\n%s", section_type, context_data)
 
         # Invoca a cadeia com os dados de contexto
-        raw_content = await chain.ainvoke({"context_data": context_data, "student_name": student_name})
+        async with _llm_semaphore:
+            raw_content = await chain.ainvoke(
+                {"context_data": context_data, "student_name": student_name},
+                config={"callbacks": [TokenUsageCallbackHandler(section_type)]},
+            )
 
         # Sanitiza a saída para garantir que é apenas HTML
         sanitized_content = _sanitize_html_output(raw_content)
-        
-        logger.info(f"Seção '{section_type}' gerada com sucesso para {student_name}.")
+        _store_cached_section(cache_key, sanitized_content)
+
+        logger.info("Seção '%s' gerada com sucesso para %s.", section_type, student_name)
         return sanitized_content
 
     except Exception as e:
-        logger.error(f"Erro ao gerar a seção '{section_type}' com LangChain: {e}")
-        return f"<p>Erro ao gerar a seção <strong>{section_type}</strong>.</p>"
\ No newline at end of file
+        logger.error("Erro ao gerar a seção '%s' com LangChain: %s", section_type, e)
+        return section_error_html(section_type)
\ No newline at end of file
@@ -1,6 +1,6 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import APIRouter, Body, Depends, HTTPException, BackgroundTasks
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from app.db.session import get_database
 from app.services import report_service
@@ -20,6 +20,21 @@ async def generate_bulk_reports_endpoint(
     background_tasks.add_task(report_service.generate_bulk_reports, db)
     return {"message": "Bulk report generation has been started in the background."}
 
+@router.post("/generate-batch", status_code=202)
+async def generate_batch_reports_endpoint(
+    background_tasks: BackgroundTasks,
+    student_ids: list[str] = Body(..., embed=True, min_length=1),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Triggers the asynchronous generation of reports for the given students.
+    """
+    # A repeated ID would generate (and save) the same report twice concurrently
+    student_ids = list(dict.fromkeys(student_ids))
+    logger.info("Batch report generation endpoint triggered for %d students.", len(student_ids))
+    background_tasks.add_task(report_service.generate_batch_reports, student_ids, db)
+    return {"message": f"Report generation for {len(student_ids)} students has been started in the background."}
+
 @router.post("/generate/{student_id}", response_class=HTMLResponse)
 async def generate_report(
     student_id: str, 
@@ -28,14 +43,33 @@ async def generate_report(
     """
     Generates a fitness report for a given student ID.
     """
-    logger.info(f"Report generation requested for student_id: {student_id}")
+    logger.info("Report generation requested for student_id: %s", student_id)
     try:
         html_content = await report_service.create_report_for_student(student_id=student_id, db=db)
-        logger.info(f"Successfully generated report for student_id: {student_id}")
+        logger.info("Successfully generated report for student_id: %s", student_id)
         return HTMLResponse(content=html_content)
     except HTTPException as e:
-        logger.error(f"HTTPException for student_id {student_id}: {e.status_code} - {e.detail}")
+        logger.error("HTTPException for student_id %s: %s - %s", student_id, e.status_code, e.detail)
+        raise
+    except Exception as e:
+        logger.critical("An unexpected error occurred for student_id %s: %s", student_id, e, exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal server error occurred.")
+
+@router.post("/generate/{student_id}/stream", response_class=StreamingResponse)
+async def stream_report(
+    student_id: str, 
+    db: AsyncIOMotorDatabase = Depends(get_database)
+) -> StreamingResponse:
+    """
+    Generates a fitness report for a given student ID, streaming the HTML as each section is generated.
+    """
+    logger.info("Streaming report generation requested for student_id: %s", student_id)
+    try:
+        html_stream = await report_service.stream_report_for_student(student_id=student_id, db=db)
+        return StreamingResponse(html_stream, media_type="text/html")
+    except HTTPException as e:
+        logger.error("HTTPException for student_id %s: %s - %s", student_id, e.status_code, e.detail)
         raise
     except Exception as e:
-        logger.critical(f"An unexpected error occurred for student_id {student_id}: {e}", exc_info=True)
+        logger.critical("An unexpected error occurred for student_id %s: %s", student_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail="An internal server error occurred.")
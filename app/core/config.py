@@ -10,6 +10,10 @@ class Settings(BaseSettings):
     PROMPTS_DIR: str = "app/agents/prompts"
     MONGO_DB_NAME: str = "mario_bot_db"
     LOG_LEVEL: str = "INFO"
+    LLM_MAX_CONCURRENCY: int = 5
+    REPORT_CACHE_TTL_SEC: int = 86400
+    BULK_CONCURRENCY: int = 8
+    REPORT_REUSE_UNCHANGED: bool = True
     API_V1_STR: str = "/api/v1"
 
 settings = Settings()
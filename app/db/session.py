@@ -12,6 +12,17 @@ async def connect_to_mongo():
     global client
     client = AsyncIOMotorClient(settings.MONGO_CONNECTION_STRING)
     print("Connected to MongoDB...")
+    await ensure_indexes(client.get_database(settings.MONGO_DB_NAME))
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """Creates the indexes backing the report queries (no-op when they already exist)."""
+    try:
+        await db["checkins"].create_index([("student_id", 1), ("checkin_date", -1)])
+        await db["relatorios"].create_index([("student_id", 1), ("generated_at", -1)])
+        await db["macro_goals"].create_index([("student_id", 1)])
+        print("MongoDB indexes ensured.")
+    except Exception as e:
+        print(f"Could not ensure MongoDB indexes: {e}")
 
 async def close_mongo_connection():
     global client
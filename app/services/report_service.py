@@ -1,18 +1,22 @@
 import logging
 import re
-import locale
 import base64
 import os
 import asyncio
+import functools
+import hashlib
+import html
+import math
+from collections import Counter
+from typing import AsyncIterator
 from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from bs4 import BeautifulSoup
-import numpy as np
 from app.core.config import settings
 
-from app.agents.report_generator_agent import generate_report_section
+from app.agents.report_generator_agent import generate_report_section, section_error_html, prompts_digest, GEMINI_MODEL
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +34,27 @@ MONTHS_PT = {
     'November': 'Novembro',
     'December': 'Dezembro'
 }
+# Indexed by date.month - 1 and date.weekday(); names come from these tables instead of the process locale
+MONTH_NAMES_PT = tuple(MONTHS_PT.values())
+WEEKDAYS_PT = ('Segunda-feira', 'Terça-feira', 'Quarta-feira', 'Quinta-feira', 'Sexta-feira', 'Sábado', 'Domingo')
+WEEKDAYS_PT_SHORT = ('Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom')
+
+@functools.lru_cache(maxsize=1024)
+def _parse_checkin_date(checkin_date: str) -> datetime:
+    """Parses an ISO check-in date; memoized because the same dates are read by several sections and reports."""
+    return datetime.fromisoformat(checkin_date)
+
+@functools.lru_cache(maxsize=1024)
+def _format_checkin_day(checkin_date: str) -> str:
+    """DD/MM (weekday) label of the daily nutrition and sleep tables, formatted once per date."""
+    date = _parse_checkin_date(checkin_date)
+    return f"{date:%d/%m} ({WEEKDAYS_PT_SHORT[date.weekday()]})"
+
+@functools.lru_cache(maxsize=1024)
+def _checkin_iso_week(checkin_date: str) -> tuple[int, int]:
+    """(ISO year, ISO week) of a check-in date; the same six weeks of history are bucketed on every report."""
+    year, week, _ = _parse_checkin_date(checkin_date).isocalendar()
+    return year, week
 
 def _infer_training_sessions_per_week(historical_checkins: list) -> int:
     """
@@ -40,15 +65,9 @@ def _infer_training_sessions_per_week(historical_checkins: list) -> int:
         logger.warning("No historical check-ins found to infer training sessions. Defaulting to 5.")
         return 5
 
-    trainings_per_week = {}
-    for checkin in historical_checkins:
-        journal = checkin.get('training', {}).get('training_journal', '').strip().lower()
-        if journal and journal not in ('', 'não treinei hoje'):
-            checkin_date = datetime.fromisoformat(checkin.get("checkin_date"))
-            year, week, _ = checkin_date.isocalendar()
-            week_key = f"{year}-{week}"
-            
-            trainings_per_week[week_key] = trainings_per_week.get(week_key, 0) + 1
+    trainings_per_week = Counter(
+        _checkin_iso_week(checkin.get("checkin_date")) for checkin in historical_checkins if _is_training_checkin(checkin)
+    )
 
     if not trainings_per_week:
         logger.warning("No valid training sessions found in history to infer split. Defaulting to 5.")
@@ -58,20 +77,75 @@ def _infer_training_sessions_per_week(historical_checkins: list) -> int:
     
     # Adiciona um teto de 5, pois é a divisão máxima padrão
     if max_sessions > 5:
-        logger.warning(f"Inferred training split of {max_sessions} is higher than the standard max. Capping at 5.")
+        logger.warning("Inferred training split of %d is higher than the standard max. Capping at 5.", max_sessions)
         return 5
 
-    logger.info(f"Inferred training split: {max_sessions} sessions per week based on historical maximum.")
+    logger.info("Inferred training split: %d sessions per week based on historical maximum.", max_sessions)
     return max_sessions
 
-def _get_base_context(checkins: list, student: dict, past_reports: list, macro_goals: dict) -> str:
+# Numeric check-in fields the weekly statistics are computed from, in _checkin_numbers order
+CHECKIN_SERIES_FIELDS = ("calories", "protein", "carbs", "fat", "sleep_hours", "sleep_quality")
+
+def _checkin_numbers(checkin: dict) -> tuple:
+    nutrition = checkin.get('nutrition', {})
+    sleep = checkin.get('sleep', {})
+    return (
+        nutrition.get('calories', 0), nutrition.get('protein', 0), nutrition.get('carbs', 0),
+        nutrition.get('fat', 0), sleep.get('sleep_duration_hours', 0), sleep.get('sleep_quality_rating', 0),
+    )
+
+def _checkin_series(checkins: list) -> dict[str, list]:
+    """
+    Collects the logged (positive) nutrition and sleep values of all check-ins per field, in a single pass.
+    A week has at most seven values per field, so plain lists beat NumPy's per-call overhead here.
+    """
+    series = {field: [] for field in CHECKIN_SERIES_FIELDS}
+    columns = [series[field] for field in CHECKIN_SERIES_FIELDS]
+    for numbers in map(_checkin_numbers, checkins):
+        for column, value in zip(columns, numbers):
+            if value > 0:
+                column.append(value)
+    return series
+
+def _mean(values: list) -> float:
+    return sum(values) / len(values) if values else 0
+
+def _pstdev(values: list, mean: float) -> float:
+    """Population standard deviation (same as statistics.pstdev) given the precomputed mean."""
+    return math.sqrt(sum((value - mean) ** 2 for value in values) / len(values)) if values else 0
+
+def _is_training_checkin(checkin: dict) -> bool:
+    return checkin.get('training', {}).get('training_journal', '').strip().lower() not in ('', 'não treinei hoje')
+
+def _week_stats(checkins: list, macro_goals: dict) -> dict:
+    """
+    Walks the week's check-ins once; the prompt context, the pillar sections, the score cards and the stored
+    report metrics all read their averages and counts from this instead of recomputing them.
+    """
+    series = _checkin_series(checkins)
+    calories = series["calories"]
+    avg_calories = _mean(calories)
+    protein_goal = macro_goals.get('protein', 1)
+    return {
+        "series": series,
+        "avg_calories": avg_calories,
+        "avg_protein": _mean(series["protein"]),
+        "avg_carbs": _mean(series["carbs"]),
+        "avg_fat": _mean(series["fat"]),
+        "calorie_cv": (_pstdev(calories, avg_calories) / avg_calories) * 100 if avg_calories > 0 else 0,
+        "avg_sleep_hours": _mean(series["sleep_hours"]),
+        "avg_sleep_quality": _mean(series["sleep_quality"]),
+        "days_less_than_6h": sum(1 for hours in series["sleep_hours"] if hours < 6),
+        "days_on_protein_goal": sum(1 for p in series["protein"] if abs(p - protein_goal) <= 10),
+        "training_checkins": [c for c in checkins if _is_training_checkin(c)],
+        "total_sets": _calculate_total_sets(checkins),
+    }
+
+def _get_base_context(checkins: list, stats: dict, student: dict, previous_report_metrics: dict | None, macro_goals: dict, dates: dict) -> str:
     """Analyzes all weekly data and formats it into a single string for the LLM prompt context."""
-    daily_nutrition = [c.get('nutrition', {}) for c in checkins]
-    calories = [n.get('calories', 0) for n in daily_nutrition if n.get('calories', 0) > 0]
-    proteins = [n.get('protein', 0) for n in daily_nutrition if n.get('protein', 0) > 0]
-    avg_calories = np.mean(calories) if calories else 0
-    avg_proteins = np.mean(proteins) if proteins else 0
-    calorie_cv = (np.std(calories) / avg_calories) * 100 if avg_calories > 0 else 0
+    avg_calories = stats["avg_calories"]
+    avg_proteins = stats["avg_protein"]
+    calorie_cv = stats["calorie_cv"]
 
     # Extract all macro goals
     calories_goal = macro_goals.get('calories', 0)
@@ -81,19 +155,11 @@ def _get_base_context(checkins: list, student: dict, past_reports: list, macro_g
 
     protein_adherence = (avg_proteins / protein_goal) * 100 if protein_goal > 0 else 0
 
-    daily_sleep = [c.get('sleep', {}) for c in checkins]
-    sleep_hours = [s.get('sleep_duration_hours', 0) for s in daily_sleep if s.get('sleep_duration_hours', 0) > 0]
-    avg_sleep_hours = np.mean(sleep_hours) if sleep_hours else 0
-    total_sets = _calculate_total_sets(checkins)
-    previous_week_data = _parse_previous_week_data(past_reports)
+    avg_sleep_hours = stats["avg_sleep_hours"]
+    total_sets = stats["total_sets"]
+    previous_week_data = _parse_previous_week_data(previous_report_metrics)
     
-    user_tz = timezone(timedelta(hours=-3))
-    end_date = datetime.now(user_tz)
-    start_date = end_date - timedelta(days=7)
-    week_number = end_date.isocalendar()[1]
-    month_name_en = end_date.strftime("%B")
-    month_name_pt = MONTHS_PT.get(month_name_en, month_name_en)
-    week_str = f"Semana {week_number} de {month_name_pt} {end_date.year} ({start_date.strftime('%d/%m')} - {end_date.strftime('%d/%m')})"
+    week_str = f"Semana {dates['week_number']} de {dates['month_pt']} {dates['year']} ({dates['start_dm']} - {dates['end_dm']})"
 
     context = f"""
 # CONTEXTO BASE - DADOS BRUTOS E ANÁLISE PRELIMINAR
@@ -135,230 +201,491 @@ CONTEXTO ADICIONAL DO ALUNO:
 """
     return context
 
+def _format_checkin_date(checkin_date: str) -> str:
+    """Formats an ISO check-in date (YYYY-MM-DD...) as DD/MM/YYYY by slicing, without parsing a datetime."""
+    year, month, day = checkin_date[:10].split("-")
+    return f"{day}/{month}/{year}"
+
 def _format_training_data(checkins: list) -> str:
     if not checkins: return "Nenhum treino registrado na semana.\n"
-    lines = []
-    for checkin in checkins:
-        date = datetime.fromisoformat(checkin.get("checkin_date")).strftime("%d/%m/%Y")
-        journal = checkin.get("training", {}).get("training_journal", "")
-        if journal: lines.append(f"**{date}**\n{journal}")
-    return "\n\n".join(lines)
+    journals = ((checkin.get("checkin_date"), checkin.get("training", {}).get("training_journal", "")) for checkin in checkins)
+    return "\n\n".join(f"**{_format_checkin_date(date)}**\n{journal}" for date, journal in journals if journal)
+
+def _nutrition_line(checkin: dict) -> str:
+    n = checkin.get("nutrition", {})
+    return f"{_format_checkin_date(checkin.get('checkin_date'))}: {n.get('calories', 0)}kcal | {n.get('protein', 0)}g | {n.get('carbs', 0)}g | {n.get('fat', 0)}g"
 
 def _format_nutrition_data(checkins: list) -> str:
     if not checkins: return "Nenhum dado de nutrição registrado na semana.\n"
-    lines = []
-    for checkin in checkins:
-        date = datetime.fromisoformat(checkin.get("checkin_date")).strftime("%d/%m/%Y")
-        n = checkin.get("nutrition", {})
-        lines.append(f"{date}: {n.get('calories', 0)}kcal | {n.get('protein', 0)}g | {n.get('carbs', 0)}g | {n.get('fat', 0)}g")
-    return "\n".join(lines)
+    return "\n".join(map(_nutrition_line, checkins))
+
+def _sleep_line(checkin: dict) -> str:
+    s = checkin.get("sleep", {})
+    return f"{_format_checkin_date(checkin.get('checkin_date'))}: {s.get('sleep_duration_hours', 0):.1f}h | Qualidade {s.get('sleep_quality_rating', 0)}/5 | {s.get('sleep_start_time', '--:--')}-{s.get('sleep_end_time', '--:--')}"
 
 def _format_sleep_data(checkins: list) -> str:
     if not checkins: return "Nenhum dado de sono registrado na semana.\n"
-    lines = []
-    for checkin in checkins:
-        date = datetime.fromisoformat(checkin.get("checkin_date")).strftime("%d/%m/%Y")
-        s = checkin.get("sleep", {})
-        lines.append(f"{date}: {s.get('sleep_duration_hours', 0):.1f}h | Qualidade {s.get('sleep_quality_rating', 0)}/5 | {s.get('sleep_start_time', '--:--')}-{s.get('sleep_end_time', '--:--')}")
-    return "\n".join(lines)
-
-def _parse_previous_week_data(past_reports: list) -> str:
-    if not past_reports: return "Nenhum relatório anterior encontrado para comparação.\n"
-    try:
-        soup = BeautifulSoup(past_reports[0].get("html_content", ""), 'html.parser')
-        metrics = soup.find_all('div', class_='metric-item')
-        data = {"Calorias médias": "N/A", "Proteína média": "N/A", "Volume total": "N/A"}
-        for metric in metrics:
-            label = metric.find('div', class_='metric-label').text.strip().lower()
-            value_element = metric.find('div', class_='metric-value')
-            if value_element:
-                value = value_element.text.strip()
-                if 'calorias médias' in label:
-                    data["Calorias médias"] = value
-                elif 'proteína média' in label:
-                    data["Proteína média"] = value
-                elif 'volume semanal' in label:
-                    data["Volume total"] = value
-        return f"Calorias médias: {data['Calorias médias']}\nProteína média: {data['Proteína média']}\nVolume treino: {data['Volume total']}"
-    except Exception as e:
-        logger.error(f"Error parsing previous report HTML: {e}")
-        return "Erro ao processar dados da semana anterior.\n"
-
-async def create_report_for_student(student_id: str, db: AsyncIOMotorDatabase) -> str:
+    return "\n".join(map(_sleep_line, checkins))
+
+# Label/value pairs of the report metric cards: <div class="metric-label">…</div> <div class="metric-value">…</div>
+_METRIC_RE = re.compile(
+    r'<div class="metric-label"[^>]*>([^<]*)</div>\s*<div class="metric-value"[^>]*>([^<]*)</div>'
+)
+# Everything but the number of a metric value such as "2100 kcal" or "~38 séries"
+_NON_NUMERIC_RE = re.compile(r'[^0-9.]')
+
+def _iter_report_metrics(report_html: str):
+    """Yields (lowercased label, value) for every metric card of a generated report."""
+    for label, value in _METRIC_RE.findall(report_html):
+        yield html.unescape(label).strip().lower(), html.unescape(value).strip()
+
+# Metric card labels of the generated report -> key of the numeric metrics stored with it
+_REPORT_METRIC_LABELS = {"calorias médias": "calories", "proteína média": "protein", "volume semanal": "total_sets"}
+
+def _report_metrics(stats: dict) -> dict:
+    """Numeric metrics saved with each report, so the next week's comparison does not have to parse its HTML."""
+    return {
+        "calories": float(stats["avg_calories"]),
+        "protein": float(stats["avg_protein"]),
+        "total_sets": stats["total_sets"],
+        "avg_sleep": float(stats["avg_sleep_hours"]),
+    }
+
+def _parse_previous_report(past_reports: list) -> dict | None:
+    """Returns the numeric metrics of the last report, falling back to its metric cards for reports saved without them."""
+    if not past_reports: return None
+    if "metrics" in past_reports[0]:
+        return past_reports[0]["metrics"]
+    metrics = {}
+    for label, value in _iter_report_metrics(past_reports[0].get("html_content", "")):
+        key = _REPORT_METRIC_LABELS.get(label)
+        if key is None: continue
+        try:
+            metrics[key] = float(_NON_NUMERIC_RE.sub('', value))
+        except ValueError:
+            continue
+    return metrics
+
+def _parse_previous_week_data(previous_report_metrics: dict | None) -> str:
+    if previous_report_metrics is None: return "Nenhum relatório anterior encontrado para comparação.\n"
+    calories = previous_report_metrics.get("calories")
+    protein = previous_report_metrics.get("protein")
+    total_sets = previous_report_metrics.get("total_sets")
+    calories_str = f"{calories:.0f} kcal" if calories is not None else "N/A"
+    protein_str = f"{protein:.0f}g" if protein is not None else "N/A"
+    total_sets_str = f"~{total_sets:.0f} séries" if total_sets is not None else "N/A"
+    return f"Calorias médias: {calories_str}\nProteína média: {protein_str}\nVolume treino: {total_sets_str}"
+
+# Placeholders do template preenchidos pelas seções geradas pelo LLM
+SECTION_PLACEHOLDERS = (
+    "overview_section",
+    "nutrition_analysis_section",
+    "sleep_analysis_section",
+    "training_analysis_section",
+    "detailed_insights_section",
+    "recommendations_section",
+    "conclusion_section",
+)
+
+LOGO_FILE = "app/static/img/logo.png"
+
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+# Only the fields the report actually reads are fetched from MongoDB
+STUDENT_PROJECTION = {"full_name": 1, "additional_context": 1}
+CHECKIN_PROJECTION = {"_id": 0, "checkin_date": 1, "nutrition": 1, "sleep": 1, "training": 1}
+HISTORY_CHECKIN_PROJECTION = {"_id": 0, "checkin_date": 1, "training.training_journal": 1}
+MACRO_GOALS_PROJECTION = {"_id": 0, "calories": 1, "protein": 1, "carbs": 1, "fat": 1}
+# The last report's HTML is fetched separately, only when it is reused or has no stored metrics
+PAST_REPORT_PROJECTION = {"input_hash": 1, "metrics": 1}
+PAST_REPORT_HTML_PROJECTION = {"_id": 0, "html_content": 1}
+
+def _report_input_hash(student_obj_id: ObjectId, end_date: datetime, student: dict, checkins: list, macro_goals: dict, total_sessions_expected: int) -> str:
+    """
+    Hashes everything a weekly report is generated from, so an unchanged week can reuse the stored report.
+    The section prompts and the report template are part of it: editing either one invalidates the stored reports.
+    The report's day is too, as its rolling date range and generation date change daily.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    template_parts = _load_report_template(settings.REPORT_TEMPLATE_FILE)
+    for part in (GEMINI_MODEL, prompts_digest(), template_parts, str(student_obj_id), end_date.date().isoformat(), student, checkins, macro_goals, total_sessions_expected):
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def _report_dates(start_date: datetime, end_date: datetime, history_start_date: datetime) -> dict:
+    """Formats the report week's dates once; the queries, the prompt context, the template and the file name share them."""
+    return {
+        "year": end_date.year,
+        "week_number": end_date.isocalendar()[1],
+        "month_pt": MONTH_NAMES_PT[end_date.month - 1],
+        "start_dm": start_date.strftime("%d/%m"),
+        "end_dm": end_date.strftime("%d/%m"),
+        "start_iso": start_date.strftime("%Y-%m-%d"),
+        "end_iso": end_date.strftime("%Y-%m-%d"),
+        "history_start_iso": history_start_date.strftime("%Y-%m-%d"),
+    }
+
+async def _fetch_report_data(student_id: str, db: AsyncIOMotorDatabase) -> dict:
+    """Validates the student ID and fetches everything the weekly report is built from."""
+    logger.info("Starting orchestrated report creation for student_id: %s", student_id)
     try:
-        locale.setlocale(locale.LC_TIME, 'pt_BR.UTF-8')
-    except locale.Error:
-        logger.warning("Locale pt_BR.UTF-8 not available. Date formatting may be in English.")
-
-    logger.info(f"Starting orchestrated report creation for student_id: {student_id}")
-    if not ObjectId.is_valid(student_id): raise HTTPException(status_code=400, detail=f"Invalid student ID: {student_id}")
+        student_obj_id = ObjectId(student_id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail=f"Invalid student ID: {student_id}")
 
-    student_obj_id = ObjectId(student_id)
-    student_data = await db["students"].find_one({"_id": student_obj_id})
-    if not student_data:
-        raise HTTPException(status_code=404, detail=f"Student with ID {student_id} not found")
-    
-    student_name = student_data.get('full_name', 'N/A')
-    logger.info(f"Student data found: {student_data}")
-    logger.info(f"Gerando relatório para {student_name}")
-
-    # Define date ranges
+    # Define date ranges; this single "now" is reused for the report text and its generated_at
     user_tz = timezone(timedelta(hours=-3))
     end_date = datetime.now(user_tz)
     start_date = end_date - timedelta(days=7)
     history_start_date = end_date - timedelta(weeks=6)
-
-    # Fetch data for the current week
-    checkins_data = await db["checkins"].find({
-        "student_id": student_obj_id, 
-        "checkin_date": {
-            "$gte": start_date.strftime("%Y-%m-%d"), 
-            "$lte": end_date.strftime("%Y-%m-%d")
-        }
-    }).to_list(length=None)
-
-    # Fetch data for the last 6 weeks to infer training split
-    historical_checkins = await db["checkins"].find({
-        "student_id": student_obj_id,
-        "checkin_date": {
-            "$gte": history_start_date.strftime("%Y-%m-%d"),
-            "$lte": end_date.strftime("%Y-%m-%d")
-        }
-    }).to_list(length=None)
+    dates = _report_dates(start_date, end_date, history_start_date)
+
+    # The queries are independent, so they run concurrently instead of paying one round trip each
+    student_data, checkins_data, historical_checkins, macro_goals_data, past_reports_data = await asyncio.gather(
+        db["students"].find_one({"_id": student_obj_id}, STUDENT_PROJECTION),
+        # Data for the current week
+        db["checkins"].find({
+            "student_id": student_obj_id, 
+            "checkin_date": {
+                "$gte": dates["start_iso"],
+                "$lte": dates["end_iso"]
+            }
+        }, CHECKIN_PROJECTION).to_list(length=None),
+        # Data for the last 6 weeks to infer training split
+        db["checkins"].find({
+            "student_id": student_obj_id,
+            "checkin_date": {
+                "$gte": dates["history_start_iso"],
+                "$lte": dates["end_iso"]
+            }
+        }, HISTORY_CHECKIN_PROJECTION).to_list(length=None),
+        db["macro_goals"].find_one({"student_id": student_obj_id}, MACRO_GOALS_PROJECTION),
+        db["relatorios"].find({"student_id": student_obj_id}, PAST_REPORT_PROJECTION).sort("generated_at", -1).limit(1).to_list(length=1),
+    )
+    if not student_data:
+        raise HTTPException(status_code=404, detail=f"Student with ID {student_id} not found")
+    
+    student_name = student_data.get('full_name', 'N/A')
+    logger.info("Student data found: %s", student_data)
+    logger.info("Gerando relatório para %s", student_name)
 
     total_sessions_expected = _infer_training_sessions_per_week(historical_checkins)
+    macro_goals_data = macro_goals_data or {}
+
+    # The latest report was generated from exactly the same inputs this week: serve it instead of calling the LLM again
+    input_hash = _report_input_hash(student_obj_id, end_date, student_data, checkins_data, macro_goals_data, total_sessions_expected)
+    last_report = past_reports_data[0] if past_reports_data else None
+    reuse_last_report = bool(settings.REPORT_REUSE_UNCHANGED and last_report and last_report.get("input_hash") == input_hash)
+    if last_report and (reuse_last_report or "metrics" not in last_report):
+        stored_html = await db["relatorios"].find_one({"_id": last_report["_id"]}, PAST_REPORT_HTML_PROJECTION)
+        last_report["html_content"] = (stored_html or {}).get("html_content", "")
+        # The stored HTML is gone (e.g. the report was deleted in between): generate the report again
+        reuse_last_report = reuse_last_report and bool(last_report["html_content"])
+    reusable_html = last_report["html_content"] if reuse_last_report else None
+    logger.info("Data fetched for student_id: %s. Found %d check-ins for the week.", student_id, len(checkins_data))
+
+    return {
+        "student_id": student_id,
+        "student_obj_id": student_obj_id,
+        "student_data": student_data,
+        "student_name": student_name,
+        "start_date": start_date,
+        "end_date": end_date,
+        "dates": dates,
+        "checkins": checkins_data,
+        "week_stats": _week_stats(checkins_data, macro_goals_data),
+        "macro_goals": macro_goals_data,
+        "past_reports": past_reports_data,
+        "total_sessions_expected": total_sessions_expected,
+        "input_hash": input_hash,
+        "reusable_html": reusable_html,
+    }
+
+async def _generate_sections(report_data: dict) -> AsyncIterator[tuple[str, str]]:
+    """
+    Generates the report sections, yielding (template placeholder, HTML) in template order as each one is ready.
+    The four pillar sections are generated concurrently; the synthesis sections are chained on top of them.
+    """
+    checkins_data = report_data["checkins"]
+    macro_goals_data = report_data["macro_goals"]
+    past_reports_data = report_data["past_reports"]
+    student_name = report_data["student_name"]
+    total_sessions_expected = report_data["total_sessions_expected"]
+
+    # The previous report is parsed once and shared by the prompt context and the nutrition section
+    previous_report_metrics = _parse_previous_report(past_reports_data)
+    base_context = _get_base_context(checkins_data, report_data["week_stats"], report_data["student_data"], previous_report_metrics, macro_goals_data, report_data["dates"])
+
+    # --- Pillar sections ---
+    # Overview, nutrition, sleep and training are analysed from the base data alone, so their LLM calls run concurrently
+    pillar_tasks = [
+        asyncio.create_task(generate_report_section("overview", base_context, student_name)),
+        asyncio.create_task(_build_nutrition_section(checkins_data, report_data["week_stats"], macro_goals_data, previous_report_metrics, base_context, student_name)),
+        asyncio.create_task(_build_sleep_analysis_section(checkins_data, base_context, student_name)),
+        asyncio.create_task(_build_training_analysis_section(report_data["week_stats"], base_context, student_name, total_sessions_expected)),
+    ]
+    try:
+        overview_content = await pillar_tasks[0]
+        yield "overview_section", f"<p>{overview_content}</p>"
 
-    macro_goals_data = await db["macro_goals"].find_one({"student_id": student_obj_id}) or {}
-    past_reports_data = await db["relatorios"].find({"student_id": student_obj_id}).sort("generated_at", -1).limit(1).to_list(length=1)
-    logger.info(f"Data fetched for student_id: {student_id}. Found {len(checkins_data)} check-ins for the week.")
-
-    # --- Chained Context Start ---
-    chained_context = _get_base_context(checkins_data, student_data, past_reports_data, macro_goals_data)
-
-    overview_content = await generate_report_section("overview", chained_context, student_name)
-    chained_context += f"\n\n# SEÇÃO GERADA: Visão Geral da Semana\n{overview_content}"
-
-    nutrition_html_content = await _build_nutrition_section(checkins_data, macro_goals_data, past_reports_data, chained_context, student_name)
-    chained_context += f"\n\n# SEÇÃO GERADA: Análise Nutricional\n{nutrition_html_content}"
+        nutrition_html_content = await pillar_tasks[1]
+        yield "nutrition_analysis_section", nutrition_html_content
 
-    sleep_html_content = await _build_sleep_analysis_section(checkins_data, chained_context, student_name)
-    chained_context += f"\n\n# SEÇÃO GERADA: Análise de Sono e Recuperação\n{sleep_html_content}"
+        sleep_html_content = await pillar_tasks[2]
+        yield "sleep_analysis_section", sleep_html_content
 
-    training_html_content = await _build_training_analysis_section(checkins_data, chained_context, student_name, total_sessions_expected)
-    chained_context += f"\n\n# SEÇÃO GERADA: Desempenho nos Treinos\n{training_html_content}"
+        training_html_content = await pillar_tasks[3]
+        yield "training_analysis_section", training_html_content
+    finally:
+        # The stream was closed early (e.g. the client disconnected): don't leave LLM calls running
+        for task in pillar_tasks:
+            task.cancel()
 
-    score_cards_html_content = _build_score_cards_section(checkins_data, macro_goals_data, total_sessions_expected)
+    # --- Chained Context Start ---
+    # The synthesis sections build on everything generated so far, one after the other
+    chained_context = (
+        f"{base_context}"
+        f"\n\n# SEÇÃO GERADA: Visão Geral da Semana\n{overview_content}"
+        f"\n\n# SEÇÃO GERADA: Análise Nutricional\n{nutrition_html_content}"
+        f"\n\n# SEÇÃO GERADA: Análise de Sono e Recuperação\n{sleep_html_content}"
+        f"\n\n# SEÇÃO GERADA: Desempenho nos Treinos\n{training_html_content}"
+    )
 
     detailed_insights_html_content = await generate_report_section("detailed_insights", chained_context, student_name)
+    yield "detailed_insights_section", detailed_insights_html_content
     chained_context += f"\n\n# SEÇÃO GERADA: Insights Detalhados\n{detailed_insights_html_content}"
 
     recommendations_html_content = await generate_report_section("recommendations", chained_context, student_name)
+    yield "recommendations_section", recommendations_html_content
     chained_context += f"\n\n# SEÇÃO GERADA: Recomendações e Ajustes\n{recommendations_html_content}"
 
     conclusion_html_content = await generate_report_section("conclusion", chained_context, student_name)
+    yield "conclusion_section", conclusion_html_content
     # --- Chained Context End ---
 
-    # Read logo and encode it in Base64
-    logo_data_uri = ""
+@functools.lru_cache(maxsize=1)
+def _load_logo_data_uri() -> str:
+    """Reads the logo and encodes it as a Base64 data URI (once per process)."""
     try:
-        with open("app/static/img/logo.png", "rb") as image_file:
+        with open(LOGO_FILE, "rb") as image_file:
             encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-            logo_data_uri = f"data:image/png;base64,{encoded_string}"
+            return f"data:image/png;base64,{encoded_string}"
     except FileNotFoundError:
-        logger.warning("Logo file not found at app/static/img/logo.png. Report will be generated without a logo.")
-
-    with open(settings.REPORT_TEMPLATE_FILE, "r", encoding="utf-8") as f:
-        report_html = f.read()
-
-    month_name_en = end_date.strftime("%B")
-    month_name_pt = MONTHS_PT.get(month_name_en, month_name_en)
-
-    report_html = report_html.replace("{{logo_data_uri}}", logo_data_uri)
-    report_html = report_html.replace("{{student_name}}", student_name)
-    report_html = report_html.replace("{{week_string}}", f"Semana {end_date.isocalendar()[1]} ({start_date.strftime('%d/%m')} - {end_date.strftime('%d/%m')})")
-    report_html = report_html.replace("{{overview_section}}", f"<p>{overview_content}</p>")
-    report_html = report_html.replace("{{nutrition_analysis_section}}", nutrition_html_content)
-    report_html = report_html.replace("{{sleep_analysis_section}}", sleep_html_content)
-    report_html = report_html.replace("{{training_analysis_section}}", training_html_content)
-    report_html = report_html.replace("{{score_cards}}", score_cards_html_content)
-    report_html = report_html.replace("{{detailed_insights_section}}", detailed_insights_html_content)
-    report_html = report_html.replace("{{recommendations_section}}", recommendations_html_content)
-    report_html = report_html.replace("{{conclusion_section}}", conclusion_html_content)
-    report_html = report_html.replace("{{next_week_string}}", f"Semana {end_date.isocalendar()[1] + 1}")
-    report_html = report_html.replace("{{generation_date}}", f"{end_date.day} de {month_name_pt} de {end_date.year}")
+        logger.warning("Logo file not found at %s. Report will be generated without a logo.", LOGO_FILE)
+        return ""
 
-    # --- Save report to local file ---
-    try:
-        today_str = end_date.strftime("%Y-%m-%d")
-        save_dir = os.path.join("relatorios_gerados", today_str)
-        os.makedirs(save_dir, exist_ok=True)
+@functools.lru_cache(maxsize=4)
+def _load_report_template(template_file: str) -> tuple[str, ...]:
+    """
+    Reads the report template from disk and splits it on its {{placeholders}} (once per process and
+    template path). The result alternates literal text (even indexes) and placeholder names (odd indexes).
+    """
+    with open(template_file, "r", encoding="utf-8") as f:
+        return tuple(_PLACEHOLDER_RE.split(f.read()))
+
+# Keeps a reference to in-flight background saves so they aren't garbage collected before finishing
+_background_tasks: set[asyncio.Task] = set()
+
+def _on_report_saved(task: asyncio.Task, student_id: str) -> None:
+    _background_tasks.discard(task)
+    if task.cancelled():
+        logger.error("Saving the report for student_id %s was cancelled.", student_id)
+    elif task.exception() is not None:
+        logger.error("Failed to save report to database for student_id %s: %s", student_id, task.exception())
+    else:
+        logger.info("Successfully saved new orchestrated report for student_id: %s", student_id)
 
-        week_number = end_date.isocalendar()[1]
-        year = end_date.year
-        filename = f"Relatorio_Semanal_{{student_name.replace(' ', '_')}}_Semana{week_number}_{year}.html"
-        save_path = os.path.join(save_dir, filename)
+def _save_report_file(save_dir: str, filename: str, report_html: str) -> str:
+    os.makedirs(save_dir, exist_ok=True)
+    save_path = os.path.join(save_dir, filename)
+    with open(save_path, "w", encoding="utf-8") as f:
+        f.write(report_html)
+    return save_path
 
-        with open(save_path, "w", encoding="utf-8") as f:
-            f.write(report_html)
-        logger.info(f"Report successfully saved to local file: {save_path}")
+async def _render_report(report_data: dict, db: AsyncIOMotorDatabase) -> AsyncIterator[str]:
+    """
+    Fills the report template, yielding HTML chunks as soon as the sections they depend on
+    are generated, and saves the complete report once the last chunk is produced.
+    """
+    student_id = report_data["student_id"]
+    student_name = report_data["student_name"]
+    end_date = report_data["end_date"]
+
+    if report_data["reusable_html"] is not None:
+        logger.info("Inputs unchanged since the last report for student_id: %s. Reusing the stored report.", student_id)
+        yield report_data["reusable_html"]
+        return
+
+    logo_data_uri = _load_logo_data_uri()
+    template_parts = _load_report_template(settings.REPORT_TEMPLATE_FILE)
+
+    dates = report_data["dates"]
+
+    # Values known before any LLM call; section placeholders are filled as they are generated
+    values = {
+        "logo_data_uri": logo_data_uri,
+        "student_name": student_name,
+        "week_string": f"Semana {dates['week_number']} ({dates['start_dm']} - {dates['end_dm']})",
+        "score_cards": _build_score_cards_section(report_data["week_stats"], report_data["macro_goals"], report_data["total_sessions_expected"]),
+        "next_week_string": f"Semana {dates['week_number'] + 1}",
+        "generation_date": f"{end_date.day} de {dates['month_pt']} de {dates['year']}",
+    }
+    sections = _generate_sections(report_data)
+
+    # Each literal part and value is copied once, straight into the output chunks
+    html_chunks = []
+    pending = []
+    for index, part in enumerate(template_parts):
+        if index % 2 == 0:
+            pending.append(part)
+            continue
+
+        if part in SECTION_PLACEHOLDERS and part not in values:
+            # Send everything already rendered before waiting on the LLM
+            if pending:
+                chunk = "".join(pending)
+                html_chunks.append(chunk)
+                yield chunk
+                pending = []
+            async for placeholder, section_html in sections:
+                values[placeholder] = section_html
+                if placeholder == part:
+                    break
+
+        # Unknown placeholders are kept verbatim
+        pending.append(values.get(part, f"{{{{{part}}}}}"))
+
+    # Sections missing from the template are still generated, as they feed the chained context
+    async for placeholder, section_html in sections:
+        values[placeholder] = section_html
+
+    if pending:
+        chunk = "".join(pending)
+        html_chunks.append(chunk)
+        yield chunk
+
+    report_html = "".join(html_chunks)
+
+    # A section that failed (e.g. a Gemini quota error) is delivered as an error notice; such a report
+    # is still saved, but without its input hash, so the next request regenerates it instead of reusing it
+    failed_sections = [
+        placeholder for placeholder in SECTION_PLACEHOLDERS
+        if section_error_html(placeholder.removesuffix("_section")) in values.get(placeholder, "")
+    ]
+    if failed_sections:
+        logger.warning("Report for student_id %s has failed sections %s; it will not be reused.", student_id, failed_sections)
+
+    # --- Save report to local file ---
+    try:
+        save_dir = os.path.join("relatorios_gerados", dates["end_iso"])
+        safe_name = student_name.replace(' ', '_')
+        filename = f"Relatorio_Semanal_{safe_name}_Semana{dates['week_number']}_{dates['year']}.html"
+        # Disk writes block; keep them off the event loop so concurrent reports keep streaming
+        save_path = await asyncio.to_thread(_save_report_file, save_dir, filename, report_html)
+        logger.info("Report successfully saved to local file: %s", save_path)
 
     except Exception as e:
-        logger.error(f"Failed to save report to local file for student {student_id}: {e}")
+        logger.error("Failed to save report to local file for student %s: %s", student_id, e)
 
     # --- Save report to database ---
-    new_report = {"student_id": student_obj_id, "generated_at": datetime.now(timezone.utc), "html_content": report_html}
-    await db["relatorios"].insert_one(new_report)
-    logger.info(f"Successfully saved new orchestrated report for student_id: {student_id}")
-    logger.debug(f"Returning report_html (type: {type(report_html)}, length: {len(report_html) if report_html is not None else 'None'})")
+    new_report = {
+        "student_id": report_data["student_obj_id"],
+        "generated_at": end_date.astimezone(timezone.utc),
+        "html_content": report_html,
+        "input_hash": None if failed_sections else report_data["input_hash"],
+        "metrics": _report_metrics(report_data["week_stats"]),
+    }
+    # The caller already has the HTML; the insert completes in the background instead of delaying the response
+    save_task = asyncio.create_task(db["relatorios"].insert_one(new_report))
+    _background_tasks.add(save_task)
+    save_task.add_done_callback(lambda task: _on_report_saved(task, student_id))
+
+async def create_report_for_student(student_id: str, db: AsyncIOMotorDatabase) -> str:
+    report_data = await _fetch_report_data(student_id, db)
+    report_html = "".join([chunk async for chunk in _render_report(report_data, db)])
+    logger.debug("Returning report_html (type: %s, length: %d)", type(report_html), len(report_html))
     return report_html
 
+async def stream_report_for_student(student_id: str, db: AsyncIOMotorDatabase) -> AsyncIterator[str]:
+    """
+    Validates and fetches the student's data up front (so errors surface as regular HTTP errors)
+    and returns an iterator that streams the report HTML as each section is generated.
+    """
+    report_data = await _fetch_report_data(student_id, db)
+    return _render_report(report_data, db)
+
+async def generate_reports_for_students(student_ids: list[str], db: AsyncIOMotorDatabase) -> list:
+    """
+    Generates the reports of the given students concurrently, with at most BULK_CONCURRENCY in flight.
+    Returns one entry per student, in order: the report HTML or the exception that aborted it.
+    """
+    # Bounds how many reports are in flight at once, so a large roster doesn't flood Mongo and Gemini
+    semaphore = asyncio.Semaphore(max(1, settings.BULK_CONCURRENCY))
+
+    async def _run(student_id: str) -> str:
+        async with semaphore:
+            return await create_report_for_student(student_id, db)
+
+    return await asyncio.gather(*(_run(student_id) for student_id in student_ids), return_exceptions=True)
+
+def _log_batch_results(labels: list[str], results: list) -> None:
+    success_count = 0
+    failure_count = 0
+
+    for label, result in zip(labels, results):
+        if isinstance(result, Exception):
+            failure_count += 1
+            logger.error("Failed to generate report for %s: %s", label, result)
+        else:
+            success_count += 1
+            logger.info("Successfully generated report for %s", label)
+
+    logger.info("Summary: %d successful, %d failed.", success_count, failure_count)
+
+async def generate_batch_reports(student_ids: list[str], db: AsyncIOMotorDatabase):
+    """Generates the reports of a given list of students in parallel, once per distinct student."""
+    student_ids = list(dict.fromkeys(student_ids))
+    logger.info("--- Starting Batch Report Generation for %d students ---", len(student_ids))
+
+    try:
+        results = await generate_reports_for_students(student_ids, db)
+        logger.info("--- Batch Report Generation Finished ---")
+        _log_batch_results(student_ids, results)
+
+    except Exception as e:
+        logger.critical("A critical error occurred during the batch generation process: %s", e)
+
 async def generate_bulk_reports(db: AsyncIOMotorDatabase):
     """Fetches all active students and generates their reports in parallel."""
     logger.info("--- Starting Bulk Report Generation ---")
     
     try:
-        active_students = await db["students"].find({"status": "active"}).to_list(length=None)
+        active_students = await db["students"].find({"status": "active"}, {"full_name": 1}).to_list(length=None)
         if not active_students:
             logger.warning("No active students found. Aborting bulk generation.")
             return
 
-        logger.info(f"Found {len(active_students)} active students. Starting parallel generation...")
+        logger.info("Found %d active students. Starting parallel generation...", len(active_students))
 
-        tasks = [create_report_for_student(str(student["_id"]), db) for student in active_students]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        results = await generate_reports_for_students([str(student["_id"]) for student in active_students], db)
 
-        success_count = 0
-        failure_count = 0
-
-        for i, result in enumerate(results):
-            student_name = active_students[i].get('full_name', 'Unknown')
-            if isinstance(result, Exception):
-                failure_count += 1
-                logger.error(f"Failed to generate report for {student_name}: {result}")
-            else:
-                success_count += 1
-                logger.info(f"Successfully generated report for {student_name}")
-
-        logger.info(f"--- Bulk Report Generation Finished ---")
-        logger.info(f"Summary: {success_count} successful, {failure_count} failed.")
+        logger.info("--- Bulk Report Generation Finished ---")
+        _log_batch_results([student.get('full_name', 'Unknown') for student in active_students], results)
 
     except Exception as e:
-        logger.critical(f"A critical error occurred during the bulk generation process: {e}")
-
-async def _build_nutrition_section(checkins: list, macro_goals: dict, past_reports: list, chained_context: str, student_name: str) -> str:
-    daily_nutrition = [c.get('nutrition', {}) for c in checkins]
-    calories = [n.get('calories', 0) for n in daily_nutrition if n.get('calories', 0) > 0]
-    proteins = [n.get('protein', 0) for n in daily_nutrition if n.get('protein', 0) > 0]
-    carbs = [n.get('carbs', 0) for n in daily_nutrition if n.get('carbs', 0) > 0]
-    fats = [n.get('fat', 0) for n in daily_nutrition if n.get('fat', 0) > 0]
-    avg_calories = np.mean(calories) if calories else 0
-    avg_proteins = np.mean(proteins) if proteins else 0
-    avg_carbs = np.mean(carbs) if carbs else 0
-    avg_fats = np.mean(fats) if fats else 0
-    calorie_cv = (np.std(calories) / avg_calories) * 100 if avg_calories > 0 else 0
+        logger.critical("A critical error occurred during the bulk generation process: %s", e)
+
+async def _build_nutrition_section(checkins: list, stats: dict, macro_goals: dict, previous_report_metrics: dict | None, chained_context: str, student_name: str) -> str:
+    calories = stats["series"]["calories"]
+    avg_calories = stats["avg_calories"]
+    avg_proteins = stats["avg_protein"]
+    avg_carbs = stats["avg_carbs"]
+    avg_fats = stats["avg_fat"]
+    calorie_cv = stats["calorie_cv"]
     protein_goal = macro_goals.get('protein', 1)
-    days_on_protein_goal = sum(1 for p in proteins if abs(p - protein_goal) <= 10)
-    prev_week_metrics = _parse_previous_week_metrics(past_reports)
+    days_on_protein_goal = stats["days_on_protein_goal"]
+    prev_week_metrics = _parse_previous_week_metrics(previous_report_metrics)
     metrics_grid_1 = _build_main_metrics_grid(avg_calories, avg_proteins, avg_carbs, avg_fats, protein_goal, prev_week_metrics)
     metrics_grid_2 = _build_consistency_metrics_grid(calorie_cv, days_on_protein_goal, len(calories))
     daily_table = _build_daily_nutrition_table(checkins, macro_goals)
@@ -395,6 +722,8 @@ def _build_main_metrics_grid(avg_cals, avg_prot, avg_carbs, avg_fats, prot_goal,
     prot_comp = get_comparison_html(avg_prot, prev_metrics.get('protein', 0), unit='g')
 
     prot_adherence = (avg_prot / prot_goal) * 100 if prot_goal > 0 else 0
+    carb_pct = (avg_carbs * 4 * 100 / avg_cals) if avg_cals > 0 else 0
+    fat_pct = (avg_fats * 9 * 100 / avg_cals) if avg_cals > 0 else 0
 
     return f"""
 <div class="metrics-grid">
@@ -427,7 +756,7 @@ def _build_main_metrics_grid(avg_cals, avg_prot, avg_carbs, avg_fats, prot_goal,
 
             <div class="metric-value">{avg_carbs:.0f}g</div>
 
-            <div class="metric-comparison">{{avg_carbs*4/avg_cals*100 if avg_cals > 0 else 0:.0f}}% das calorias totais</div>
+            <div class="metric-comparison">{carb_pct:.0f}% das calorias totais</div>
 
         </div>
 
@@ -437,13 +766,14 @@ def _build_main_metrics_grid(avg_cals, avg_prot, avg_carbs, avg_fats, prot_goal,
 
             <div class="metric-value">{avg_fats:.0f}g</div>
 
-            <div class="metric-comparison">{{avg_fats*9/avg_cals*100 if avg_cals > 0 else 0:.0f}}% das calorias totais</div>
+            <div class="metric-comparison">{fat_pct:.0f}% das calorias totais</div>
 
         </div>
 
     </div>"""
 
 def _build_consistency_metrics_grid(cv, days_on_goal, total_days) -> str:
+    adherence_pct = (days_on_goal * 100 / total_days) if total_days > 0 else 0
     return f"""
 <h3>Consistência Nutricional</h3>
     <div class="metrics-grid">
@@ -455,10 +785,27 @@ def _build_consistency_metrics_grid(cv, days_on_goal, total_days) -> str:
         <div class="metric-item">
             <div class="metric-label">Dias na Meta Proteica</div>
             <div class="metric-value">{days_on_goal}/{total_days}</div>
-            <div class="metric-comparison"><span class="positive">{{days_on_goal/total_days*100 if total_days > 0 else 0:.0f}}% de aderência</span></div>
+            <div class="metric-comparison"><span class="positive">{adherence_pct:.0f}% de aderência</span></div>
         </div>
     </div>"""
 
+# Daily macro deviation from the goal: up to 10% is on target, up to 20% is a warning, beyond that critical
+TOLERANCE_NORMAL = 0.10
+TOLERANCE_WARNING = 0.20
+# (status, CSS class) per alert level: 0 Meta, 1 Atenção, 2 Crítico
+NUTRITION_STATUS = (("Meta", "positive"), ("Atenção", "warning"), ("Crítico", "critical"))
+
+def _macro_alert_level(current: float, goal: float, is_protein: bool) -> int:
+    if goal <= 0:
+        return 0
+    deviation = abs(current - goal) / goal
+    # Protein has a stricter rule for being too low
+    if is_protein and current < goal * (1 - TOLERANCE_NORMAL):
+        return 2 if deviation > TOLERANCE_WARNING else 1
+    if deviation > TOLERANCE_WARNING:
+        return 2
+    return 1 if deviation > TOLERANCE_NORMAL else 0
+
 def _build_daily_nutrition_table(checkins: list, macro_goals: dict) -> str:
     rows = []
     calories_goal = macro_goals.get('calories', 0)
@@ -467,53 +814,22 @@ def _build_daily_nutrition_table(checkins: list, macro_goals: dict) -> str:
     fat_goal = macro_goals.get('fat', 0)
 
     for checkin in checkins:
-        date = datetime.fromisoformat(checkin.get("checkin_date")).strftime("%d/%m (%a)")
+        date = _format_checkin_day(checkin.get("checkin_date"))
         n = checkin.get("nutrition", {})
-        
+
         current_calories = n.get('calories', 0)
         current_protein = n.get('protein', 0)
         current_carbs = n.get('carbs', 0)
         current_fat = n.get('fat', 0)
 
-        # Default status
-        status = "Meta"
-        status_class = "positive"
-
-        # Define tolerances
-        TOLERANCE_NORMAL = 0.10  # +/- 10% is OK
-        TOLERANCE_WARNING = 0.20 # +/- 20% is a warning
-
-        # Check each macro
-        macros = [
-            (current_calories, calories_goal, 'calorias'),
-            (current_protein, protein_goal, 'proteína'),
-            (current_carbs, carbs_goal, 'carboidratos'),
-            (current_fat, fat_goal, 'gordura')
-        ]
-
-        highest_alert_level = 0 # 0: Meta, 1: Atenção, 2: Crítico
-
-        for current, goal, name in macros:
-            if goal > 0:
-                deviation = abs(current - goal) / goal
-
-                # Protein has a stricter rule for being too low
-                if name == 'proteína' and current < goal * (1 - TOLERANCE_NORMAL):
-                    if deviation > TOLERANCE_WARNING: # More than 20% below
-                        highest_alert_level = max(highest_alert_level, 2)
-                    else:
-                        highest_alert_level = max(highest_alert_level, 1)
-                elif deviation > TOLERANCE_WARNING:
-                    highest_alert_level = max(highest_alert_level, 2)
-                elif deviation > TOLERANCE_NORMAL:
-                    highest_alert_level = max(highest_alert_level, 1)
-
-        if highest_alert_level == 2:
-            status = "Crítico"
-            status_class = "critical"
-        elif highest_alert_level == 1:
-            status = "Atenção"
-            status_class = "warning"
+        # The day's status is the highest alert level among its macros
+        highest_alert_level = max(
+            _macro_alert_level(current_calories, calories_goal, False),
+            _macro_alert_level(current_protein, protein_goal, True),
+            _macro_alert_level(current_carbs, carbs_goal, False),
+            _macro_alert_level(current_fat, fat_goal, False),
+        )
+        status, status_class = NUTRITION_STATUS[highest_alert_level]
 
         rows.append(f"""
 <tr>
@@ -535,24 +851,8 @@ def _build_daily_nutrition_table(checkins: list, macro_goals: dict) -> str:
         </tbody>
     </table>"""
 
-def _parse_previous_week_metrics(past_reports: list) -> dict:
-    if not past_reports: return {}
-    try:
-        soup = BeautifulSoup(past_reports[0].get("html_content", ""), 'html.parser')
-        metrics = {}
-        for metric_item in soup.find_all('div', class_='metric-item'):
-            label = metric_item.find('div', class_='metric-label').text.strip().lower()
-            value_str = metric_item.find('div', class_='metric-value').text.strip()
-            try:
-                value = float(re.sub(r'[^0-9.]', '', value_str))
-            except (ValueError, TypeError):
-                value = 0
-            if 'calorias' in label: metrics['calories'] = value
-            if 'proteína' in label: metrics['protein'] = value
-        return metrics
-    except Exception as e:
-        logger.error(f"Error parsing previous report for metrics: {e}")
-        return {}
+def _parse_previous_week_metrics(previous_report_metrics: dict | None) -> dict:
+    return {key: value for key, value in (previous_report_metrics or {}).items() if key in ('calories', 'protein')}
 
 async def _build_sleep_analysis_section(checkins: list, chained_context: str, student_name: str) -> str:
     daily_table = _build_daily_sleep_table(checkins)
@@ -564,12 +864,12 @@ async def _build_sleep_analysis_section(checkins: list, chained_context: str, st
 def _build_daily_sleep_table(checkins: list) -> str:
     rows = []
     for checkin in checkins:
-        date = datetime.fromisoformat(checkin.get("checkin_date")).strftime("%d/%m (%a)")
+        date = _format_checkin_day(checkin.get("checkin_date"))
         s = checkin.get("sleep", {})
         status = "Adequado" if s.get('sleep_duration_hours', 0) >= 7 else "Limite inferior"
         status_class = "positive" if status == "Adequado" else "warning"
         rows.append(f"""
-tr>
+<tr>
             <td>{date}</td>
             <td>{s.get('sleep_duration_hours', 0):.1f}h</td>
             <td>{s.get('sleep_quality_rating', 0)}/5</td>
@@ -587,10 +887,10 @@ tr>
         </tbody>
     </table>"""
 
-async def _build_training_analysis_section(checkins: list, chained_context: str, student_name: str, total_sessions_expected: int) -> str:
-    training_checkins = [c for c in checkins if c.get('training', {}).get('training_journal', '').strip().lower() not in ('', 'não treinei hoje')]
+async def _build_training_analysis_section(stats: dict, chained_context: str, student_name: str, total_sessions_expected: int) -> str:
+    training_checkins = stats["training_checkins"]
     sessions_performed = len(training_checkins)
-    total_sets = _calculate_total_sets(checkins)
+    total_sets = stats["total_sets"]
     adherence_percentage = (sessions_performed / total_sessions_expected * 100) if total_sessions_expected > 0 else 0
 
     metrics_grid = f"""
@@ -615,16 +915,37 @@ async def _build_training_analysis_section(checkins: list, chained_context: str,
 {llm_insights}"""
 
 def _calculate_total_sets(checkins: list) -> int:
-    total_sets = 0
-    for checkin in checkins:
-        journal = checkin.get('training', {}).get('training_journal', '')
-        total_sets += len(re.findall(r'série', journal, re.IGNORECASE))
-    return total_sets
+    # Each logged set in a training journal starts with "Série" (any casing); a literal count needs no regex
+    return sum(checkin.get('training', {}).get('training_journal', '').lower().count('série') for checkin in checkins)
+
+# Linha de data que o Hevy insere logo após o nome do treino, ex: "Monday, Nov 3, 2025"
+_HEVY_DATE_RE = re.compile(r'\w+day, \w+ \d+, \d+')
+
+def _format_journal_exercises(lines: list) -> str:
+    """Renders the exercise lines of a training journal in one pass: each exercise name followed by its sets."""
+    parts = []
+    has_exercise = False
+    for line in lines:
+        line = line.strip()
+        if not line or "@hevyapp" in line or "hevy.com" in line:
+            continue
+
+        # Se a linha não começa com "Série", é um novo exercício
+        if not line.lower().startswith('série'):
+            parts.append(f"<strong>{line}</strong><br>")
+            has_exercise = True
+        else:
+            # É uma linha de série do exercício atual
+            if not has_exercise:
+                parts.append("<strong>Exercícios Diversos</strong><br>")
+                has_exercise = True
+            parts.append(f"• {line}<br>")
+    return "".join(parts)
 
 def _build_training_details(checkins: list) -> str:
     details = []
     for checkin in checkins:
-        date = datetime.fromisoformat(checkin.get("checkin_date"))
+        date = _parse_checkin_date(checkin.get("checkin_date"))
         training_data = checkin.get('training', {})
         journal = training_data.get('training_journal', '')
         observation = training_data.get('student_observation', 'Sem observações relatadas')
@@ -632,40 +953,19 @@ def _build_training_details(checkins: list) -> str:
         if not journal or journal.strip().lower() == "não treinei hoje":
             continue
 
-        lines = journal.strip().split('\n')
+        lines = journal.strip().splitlines()
         
         # A primeira linha é o nome do treino, ex: "A - Peito e Ombro"
         training_name = lines.pop(0).strip() if lines else 'Treino'
         # A segunda linha é a data, que já temos, então podemos ignorar
-        if lines and re.match(r'\w+day, \w+ \d+, \d+', lines[0]):
+        if lines and _HEVY_DATE_RE.match(lines[0]):
             lines.pop(0)
 
-        exercises_html = ""
-        current_exercise = None
-
-        for line in lines:
-            line = line.strip()
-            if not line or "@hevyapp" in line or "hevy.com" in line:
-                continue
-
-            # Se a linha não começa com "Série", é um novo exercício
-            if not line.lower().startswith('série'):
-                if current_exercise:
-                    exercises_html += f"<strong>{{current_exercise}}</strong><br>"
-                current_exercise = line
-            else:
-                # É uma linha de série, anexa ao exercício atual
-                if not current_exercise:
-                    current_exercise = "Exercícios Diversos"
-                exercises_html += f"• {{line}}<br>"
-        
-        # Adiciona o último exercício processado
-        if current_exercise:
-            exercises_html += f"<strong>{{current_exercise}}</strong><br>"
+        exercises_html = _format_journal_exercises(lines)
 
         details.append(f"""
 <div class="training-detail manter-junto">
-            <strong>{training_name} ({date.strftime("%d/%m - %A")})</strong><br>
+            <strong>{training_name} ({date:%d/%m} - {WEEKDAYS_PT[date.weekday()]})</strong><br>
             <em>Principais exercícios:</em><br>
             {exercises_html}
             <em>Observação:</em> "{observation}"
@@ -673,14 +973,14 @@ def _build_training_details(checkins: list) -> str:
 
     return "\n".join(details)
 
-def _build_score_cards_section(checkins: list, macro_goals: dict, total_sessions_expected: int) -> str:
+def _build_score_cards_section(stats: dict, macro_goals: dict, total_sessions_expected: int) -> str:
+    series = stats["series"]
+
     # --- Sleep Score ---
-    daily_sleep = [c.get('sleep', {}) for c in checkins]
-    sleep_hours = [s.get('sleep_duration_hours', 0) for s in daily_sleep if s.get('sleep_duration_hours', 0) > 0]
-    avg_sleep_hours = np.mean(sleep_hours) if sleep_hours else 0
-    sleep_quality = [s.get('sleep_quality_rating', 0) for s in daily_sleep if s.get('sleep_quality_rating', 0) > 0]
-    avg_sleep_quality = np.mean(sleep_quality) if sleep_quality else 0
-    days_less_than_6h = sum(1 for s in sleep_hours if s < 6)
+    sleep_hours = series["sleep_hours"]
+    avg_sleep_hours = stats["avg_sleep_hours"]
+    avg_sleep_quality = stats["avg_sleep_quality"]
+    days_less_than_6h = stats["days_less_than_6h"]
 
     rec_score = 0
     rec_status_class = "critical"
@@ -696,7 +996,7 @@ def _build_score_cards_section(checkins: list, macro_goals: dict, total_sessions
         rec_score = 5
 
     # --- Performance Score ---
-    training_checkins = [c for c in checkins if c.get('training', {}).get('training_journal', '').strip().lower() not in ('', 'não treinei hoje')]
+    training_checkins = stats["training_checkins"]
     sessions_performed = len(training_checkins)
     training_adherence = (sessions_performed / total_sessions_expected) * 100 if total_sessions_expected > 0 else 0
 
@@ -714,11 +1014,10 @@ def _build_score_cards_section(checkins: list, macro_goals: dict, total_sessions
         perf_score = 6
 
     # --- Nutrition Score ---
-    daily_nutrition = [c.get('nutrition', {}) for c in checkins]
-    proteins = [n.get('protein', 0) for n in daily_nutrition if n.get('protein', 0) > 0]
+    proteins = series["protein"]
     protein_goal = macro_goals.get('protein', 1)
-    avg_proteins = np.mean(proteins) if proteins else 0
-    protein_adherence_days = sum(1 for p in proteins if abs(p - protein_goal) <= 10)
+    avg_proteins = stats["avg_protein"]
+    protein_adherence_days = stats["days_on_protein_goal"]
     total_nutrition_days = len(proteins)
 
     nutri_score = 0
@@ -733,25 +1032,22 @@ def _build_score_cards_section(checkins: list, macro_goals: dict, total_sessions
             nutri_status_class = "positive"
     else:
         nutri_score = 6
-    rec_card = f"""
+    return f"""
+
 <div class="score-card {rec_status_class}">
         <div class="score-label">Recuperação</div>
         <div class="score-value">{rec_score}/10</div>
         <div class="score-detail">Sono: {avg_sleep_hours:.1f}h média<br>Qualidade: {avg_sleep_quality:.1f}/5<br>{days_less_than_6h} dias <6h</div>
-    </div>"""
-    perf_card = f"""
+    </div>
+
 <div class="score-card {perf_status_class}">
         <div class="score-label">Desempenho</div>
         <div class="score-value">{perf_score}/10</div>
         <div class="score-detail">Aderência: {training_adherence:.0f}%<br>{sessions_performed}/{total_sessions_expected} treinos realizados</div>
-    </div>"""
-    nutri_card = f"""
+    </div>
+
 <div class="score-card {nutri_status_class}">
         <div class="score-label">Alimentação</div>
         <div class="score-value">{nutri_score}/10</div>
         <div class="score-detail">Proteína: {avg_proteins:.0f}g média<br>Aderência: {protein_adherence_days}/{total_nutrition_days} dias<br>Meta: {protein_goal}g</div>
-    </div>"""
-    return f"""
-{rec_card}
-{perf_card}
-{nutri_card}"""
\ No newline at end of file
+    </div>"""
\ No newline at end of file
@@ -1,9 +1,6 @@
-from fastapi import FastAPI
-from app.core.config import settings
-from app.api.v1.router import api_router
-
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 from app.core.config import settings
 from app.api.v1.router import api_router
 from app.db.session import connect_to_mongo, close_mongo_connection
@@ -24,6 +21,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Reports are large, highly repetitive HTML; streamed responses are compressed chunk by chunk
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.get("/")
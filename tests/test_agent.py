@@ -1,7 +1,8 @@
 import pytest
 import asyncio
-from unittest.mock import patch, AsyncMock, MagicMock
-from app.agents.report_generator_agent import generate_report_content
+from unittest.mock import patch, AsyncMock, MagicMock, ANY
+from app.agents import report_generator_agent
+from app.agents.report_generator_agent import generate_report_section, USER_DATA_TEMPLATE, _sanitize_html_output, TokenUsageCallbackHandler
 
 # Helper to create an awaitable result
 def async_return(result):
@@ -9,41 +10,126 @@ def async_return(result):
     f.set_result(result)
     return f
 
+@pytest.fixture(autouse=True)
+def clear_agent_caches():
+    """The LLM client and prompts are cached per process; start each test from a clean state."""
+    report_generator_agent._get_llm.cache_clear()
+    report_generator_agent._get_prompt.cache_clear()
+    report_generator_agent._get_chain.cache_clear()
+    report_generator_agent._load_prompt_template.cache_clear()
+    report_generator_agent.prompts_digest.cache_clear()
+    report_generator_agent._section_cache.clear()
+    report_generator_agent._token_usage.clear()
+    yield
+
 @pytest.mark.asyncio
 @patch("app.agents.report_generator_agent.ChatGoogleGenerativeAI")
-@patch("app.agents.report_generator_agent.PromptTemplate")
-@patch("builtins.open")
+@patch("app.agents.report_generator_agent.ChatPromptTemplate")
+@patch("app.agents.report_generator_agent._load_prompt_template")
 @patch("app.agents.report_generator_agent.StrOutputParser")
-async def test_generate_report_content(mock_output_parser, mock_open, mock_prompt_template, mock_llm):
+async def test_generate_report_section(mock_output_parser, mock_load_prompt, mock_prompt_template, mock_llm):
     """
-    Tests that the agent formats data correctly and invokes the chain.
+    Tests that the agent builds the prompt (static instructions first, student data last)
+    and invokes the chain with the context.
     """
     # Arrange
-    mock_open.return_value.__enter__.return_value.read.return_value = "Prompt content: {user_data_for_prompt}"
+    mock_load_prompt.return_value = "Instruções estáticas da seção."
 
     # Mock the final chain instance that will be returned by the chaining operations
     mock_final_chain = AsyncMock()
-    mock_final_chain.ainvoke.return_value = "<html>Generated Report</html>"
+    mock_final_chain.ainvoke.return_value = "```html\n<p>Visão geral</p>\n```"
 
     # Configure the mocks to return the mock_final_chain when chained
-    # This is a bit hacky due to the | operator, but it works.
     # Essentially, we want `prompt | llm | StrOutputParser()` to result in `mock_final_chain`
-    # We need to mock the __or__ method of the PromptTemplate instance, then the __or__ of the LLM instance, then the __or__ of the StrOutputParser instance.
 
     # Mock the result of `prompt | llm`
     mock_prompt_llm_chain = MagicMock()
-    mock_prompt_template.return_value.__or__.return_value = mock_prompt_llm_chain
+    mock_prompt_template.from_messages.return_value.__or__.return_value = mock_prompt_llm_chain
 
     # Mock the result of `(prompt | llm) | StrOutputParser()`
     mock_prompt_llm_chain.__or__.return_value = mock_final_chain
 
-    user_data_for_prompt = "ALUNO: Test Student\nSEMANA: 1 de Nov 2025"
+    context_data = "ALUNO: Test Student\nSEMANA: 1 de Nov 2025"
+
+    # Act
+    result = await generate_report_section("overview", context_data, "Test Student")
+
+    # Assert
+    assert result == "<p>Visão geral</p>"
+    mock_prompt_template.from_messages.assert_called_once_with([
+        ("system", "Instruções estáticas da seção."),
+        ("human", USER_DATA_TEMPLATE),
+    ])
+    mock_final_chain.ainvoke.assert_called_once_with({"context_data": context_data, "student_name": "Test Student"}, config=ANY)
+
+
+@pytest.mark.asyncio
+@patch("app.agents.report_generator_agent.ChatGoogleGenerativeAI")
+@patch("app.agents.report_generator_agent._load_prompt_template")
+async def test_generate_report_section_reuses_llm_and_prompt(mock_load_prompt, mock_llm):
+    """
+    Tests that repeated calls reuse the same LLM client, prompt and chain instead of rebuilding them,
+    even when a call asks for a different temperature.
+    """
+    # Arrange
+    mock_load_prompt.return_value = "Instruções estáticas da seção."
 
     # Act
-    result = await generate_report_content(user_data_for_prompt)
+    await generate_report_section("overview", "contexto 1", "Aluno 1")
+    await generate_report_section("overview", "contexto 2", "Aluno 2", temperature=0.2)
+
+    await generate_report_section("overview", "contexto 3", "Aluno 3", temperature=0.2)
 
     # Assert
-    assert result == "<html>Generated Report</html>"
-    mock_final_chain.ainvoke.assert_called_once_with({"user_data_for_prompt": user_data_for_prompt})
+    mock_llm.assert_called_once()
+    mock_llm.return_value.bind.assert_called_once_with(temperature=0.2)
+    assert report_generator_agent._get_chain.cache_info().currsize == 2
+    mock_load_prompt.assert_called_once_with("overview")
 
 
+@pytest.mark.asyncio
+@patch("app.agents.report_generator_agent._get_llm")
+@patch("app.agents.report_generator_agent._get_prompt")
+async def test_generate_report_section_uses_response_cache(mock_get_prompt, mock_get_llm):
+    """
+    Tests that an identical section request is served from the local cache without calling the LLM again.
+    """
+    # Arrange
+    mock_final_chain = AsyncMock()
+    mock_final_chain.ainvoke.return_value = "<p>Insights</p>"
+    mock_get_prompt.return_value.__or__.return_value.__or__.return_value = mock_final_chain
+
+    # Act
+    first = await generate_report_section("sleep_analysis", "mesmo contexto", "Aluno 1")
+    second = await generate_report_section("sleep_analysis", "mesmo contexto", "Aluno 1")
+    other_student = await generate_report_section("sleep_analysis", "mesmo contexto", "Aluno 2")
+
+    # Assert
+    assert first == second == other_student == "<p>Insights</p>"
+    assert mock_final_chain.ainvoke.call_count == 2
+
+
+def test_sanitize_html_output():
+    """
+    Tests that conversational intros, markdown fences and repeated characters are stripped from the LLM output.
+    """
+    raw_output = "Com certeza, GN Coach. Segue a análise da semana:\n\n```html\n<p>Conteúdo</p>\n```"
+    assert _sanitize_html_output(raw_output) == "<p>Conteúdo</p>"
+    assert _sanitize_html_output("t t t t t t\n<div>ok</div>") == "<div>ok</div>"
+
+
+def test_token_usage_callback_tracks_cached_tokens():
+    """
+    Tests that the usage callback accumulates input, cached input and output tokens per section.
+    """
+    # Arrange
+    message = MagicMock(usage_metadata={"input_tokens": 1200, "output_tokens": 300, "input_token_details": {"cache_read": 1000}})
+    response = MagicMock(generations=[[MagicMock(message=message)]])
+    handler = TokenUsageCallbackHandler("overview")
+
+    # Act
+    handler.on_llm_end(response)
+    handler.on_llm_end(response)
+
+    # Assert
+    assert report_generator_agent._token_usage["overview"] == {"calls": 2, "input": 2400, "cached_input": 2000, "output": 600}
@@ -21,7 +21,7 @@ async def test_generate_report_success():
     student_id = "60d5ec49f7e4e2a4e8f3b8a2"
     
     # Mock a função do serviço diretamente, já que a dependência do DB já foi mockada
-    with patch("app.api.v1.endpoints.reports.create_report_for_student", new_callable=AsyncMock) as mock_create_report:
+    with patch("app.services.report_service.create_report_for_student", new_callable=AsyncMock) as mock_create_report:
         mock_create_report.return_value = "<html><body><h1>Generated Report</h1></body></html>"
 
         response = client.post(f"/api/v1/reports/generate/{student_id}")
@@ -38,10 +38,63 @@ async def test_generate_report_not_found():
     from fastapi import HTTPException
     student_id = "non_existent_id"
 
-    with patch("app.api.v1.endpoints.reports.create_report_for_student", new_callable=AsyncMock) as mock_create_report:
+    with patch("app.services.report_service.create_report_for_student", new_callable=AsyncMock) as mock_create_report:
         mock_create_report.side_effect = HTTPException(status_code=404, detail="Student not found")
 
         response = client.post(f"/api/v1/reports/generate/{student_id}")
 
         assert response.status_code == 404
         assert "Student not found" in response.json()["detail"]
+
+@pytest.mark.asyncio
+async def test_stream_report_success():
+    """
+    Tests that the streaming endpoint returns the report HTML chunks as a single HTML body.
+    """
+    student_id = "60d5ec49f7e4e2a4e8f3b8a2"
+
+    async def html_chunks():
+        yield "<html><body>"
+        yield "<h1>Generated Report</h1>"
+        yield "</body></html>"
+
+    with patch("app.services.report_service.stream_report_for_student", new_callable=AsyncMock) as mock_stream_report:
+        mock_stream_report.return_value = html_chunks()
+
+        response = client.post(f"/api/v1/reports/generate/{student_id}/stream")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/html")
+        assert response.text == "<html><body><h1>Generated Report</h1></body></html>"
+        mock_stream_report.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_generate_batch_reports_accepted():
+    """
+    Tests that the batch endpoint schedules the generation once per distinct student and returns 202.
+    """
+    student_ids = ["60d5ec49f7e4e2a4e8f3b8a2", "60d5ec49f7e4e2a4e8f3b8a3"]
+
+    with patch("app.services.report_service.generate_batch_reports", new_callable=AsyncMock) as mock_batch:
+        response = client.post("/api/v1/reports/generate-batch", json={"student_ids": student_ids + student_ids[:1]})
+
+        assert response.status_code == 202
+        mock_batch.assert_called_once()
+        assert mock_batch.call_args.args[0] == student_ids
+
+@pytest.mark.asyncio
+async def test_generate_report_is_gzip_compressed():
+    """
+    Tests that large report responses are gzip-compressed for clients that accept it.
+    """
+    student_id = "60d5ec49f7e4e2a4e8f3b8a2"
+    report_html = "<html><body>" + "<p>Seção do relatório</p>" * 200 + "</body></html>"
+
+    with patch("app.services.report_service.create_report_for_student", new_callable=AsyncMock) as mock_create_report:
+        mock_create_report.return_value = report_html
+
+        response = client.post(f"/api/v1/reports/generate/{student_id}", headers={"Accept-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.text == report_html
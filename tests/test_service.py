@@ -2,10 +2,12 @@ import pytest
 import asyncio
 from unittest.mock import AsyncMock, patch, MagicMock
 from bson import ObjectId
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, timezone, UTC
 from fastapi import HTTPException
 
-from app.services.report_service import create_report_for_student
+from app.services import report_service
+from app.services.report_service import create_report_for_student, stream_report_for_student, generate_bulk_reports
+from app.agents.report_generator_agent import section_error_html
 from app.core.config import settings
 
 # Mocks for database documents
@@ -16,7 +18,7 @@ SAMPLE_CHECKIN = {
     "_id": ObjectId(),
     "student_id": STUDENT_ID,
     "checkin_date": "2025-11-01",
-    "created_at": datetime.now(UTC),
+    "created_at": datetime(2025, 11, 1, 12, 0, tzinfo=UTC),
     "nutrition": { "calories": 2500, "protein": 180, "carbs": 250, "fat": 90 },
     "sleep": { "sleep_duration_hours": 8.0, "sleep_quality_rating": 5, "sleep_start_time": "23:00", "sleep_end_time": "07:00" },
     "training": { "training_journal": "Supino Reto\nSérie 1: 100 kg x 5", "student_observation": "Me senti forte hoje."
@@ -50,17 +52,43 @@ IDEAL_TEMPLATE_CONTENT = """<!DOCTYPE html>
 </body>
 </html>"""
 
+# Canned specialist-agent output per section
+SECTION_RESPONSES = {
+    "overview": "Este é o resumo da visão geral gerado pelo LLM.",
+    "nutrition_analysis": "<p>Insights de nutrição gerados pelo LLM.</p>",
+    "sleep_analysis": "<p>Insights de sono gerados pelo LLM.</p>",
+    "training_analysis": "<p>Insights de treino gerados pelo LLM.</p>",
+    "detailed_insights": "<p>Insights detalhados gerados pelo LLM.</p>",
+    "recommendations": "<p>Recomendações geradas pelo LLM.</p>",
+    "conclusion": "<p>Conclusão gerada pelo LLM.</p>",
+}
+
 @pytest.fixture(autouse=True)
 def override_settings(monkeypatch):
     monkeypatch.setattr(settings, 'REPORT_TEMPLATE_FILE', 'mock_template.html')
 
-@pytest.mark.asyncio
-async def test_create_report_orchestration_flow():
-    """
-    Tests the new orchestration flow, ensuring the correct agent is called
-    and the template is populated.
-    """
-    # Arrange
+@pytest.fixture(autouse=True)
+def clear_file_caches():
+    """The template and logo are cached per process; read them through each test's mocked open."""
+    report_service._load_report_template.cache_clear()
+    report_service._load_logo_data_uri.cache_clear()
+    yield
+
+# Mock the file system reads: the logo is read as bytes, the template as text
+def open_side_effect(file, mode="r", *args, **kwargs):
+    file_mock = MagicMock()
+    file_mock.__enter__.return_value.read.return_value = b"logo" if "b" in mode else IDEAL_TEMPLATE_CONTENT
+    return file_mock
+
+@pytest.fixture(autouse=True)
+def mock_report_files():
+    """Serves the template and logo from memory and keeps generated reports off the disk."""
+    with patch("builtins.open", side_effect=open_side_effect), \
+         patch("app.services.report_service._save_report_file", return_value="relatorios_gerados/mock.html"):
+        yield
+
+def _make_mock_db():
+    """Builds a mocked database returning the sample documents, plus the mocked reports collection."""
     mock_db = MagicMock()
     mock_relatorios_collection = MagicMock(
         insert_one=AsyncMock(return_value=None),
@@ -79,51 +107,337 @@ async def test_create_report_orchestration_flow():
         "macro_goals": MagicMock(find_one=AsyncMock(return_value=SAMPLE_MACRO_GOALS)),
         "relatorios": mock_relatorios_collection
     }[collection_name]
+    return mock_db, mock_relatorios_collection
+
+@pytest.mark.asyncio
+async def test_create_report_orchestration_flow():
+    """
+    Tests the new orchestration flow, ensuring the correct agent is called
+    and the template is populated.
+    """
+    # Arrange
+    mock_db, mock_relatorios_collection = _make_mock_db()
+
+    # Mock the specialist agent to return different content based on the section
+    async def side_effect(section_type, context_data, student_name):
+        return SECTION_RESPONSES.get(section_type, "")
+
+    with patch("app.services.report_service.generate_report_section", new_callable=AsyncMock) as mock_generate_section:
+        mock_generate_section.side_effect = side_effect
+
+        # Act
+        final_html = await create_report_for_student(str(STUDENT_ID), mock_db)
+
+        # Assert
+        # 1. Check that the correct agents were called
+        assert [call.args[0] for call in mock_generate_section.call_args_list] == [
+            "overview", "nutrition_analysis", "sleep_analysis", "training_analysis",
+            "detailed_insights", "recommendations", "conclusion",
+        ]
+
+        # 2. Check that the template was populated correctly
+        assert "<p>Conclusão gerada pelo LLM.</p>" in final_html
+
+        # 3. Check that no sections are placeholder comments
+        assert "<!--" not in final_html
+
+        # 4. Check that the report was saved with its numeric metrics
+        mock_relatorios_collection.insert_one.assert_called_once()
+        saved_metrics = mock_relatorios_collection.insert_one.call_args.args[0]["metrics"]
+        assert saved_metrics == {"calories": 2500.0, "protein": 180.0, "total_sets": 1, "avg_sleep": 8.0}
+
+@pytest.mark.asyncio
+async def test_stream_report_yields_before_sections_are_generated():
+    """
+    Tests that the streamed report sends the template head before the first LLM call
+    and that the streamed chunks add up to the saved report.
+    """
+    # Arrange
+    mock_db, mock_relatorios_collection = _make_mock_db()
+
+    with patch("app.services.report_service.generate_report_section", new_callable=AsyncMock) as mock_generate_section:
+        mock_generate_section.return_value = "<p>Seção gerada pelo LLM.</p>"
+
+        # Act
+        html_stream = await stream_report_for_student(str(STUDENT_ID), mock_db)
+        first_chunk = await anext(html_stream)
+        calls_before_first_chunk = mock_generate_section.call_count
+        remaining_chunks = [chunk async for chunk in html_stream]
+
+        # Assert
+        assert calls_before_first_chunk == 0
+        assert first_chunk.endswith('<div id="overview">')
+        assert mock_generate_section.call_count == 7
+        saved_report = mock_relatorios_collection.insert_one.call_args.args[0]
+        assert saved_report["html_content"] == first_chunk + "".join(remaining_chunks)
+
+@pytest.mark.asyncio
+async def test_pillar_sections_are_generated_concurrently():
+    """
+    Tests that the overview, nutrition, sleep and training sections are generated at the same time
+    and that the synthesis sections receive all of them in their context.
+    """
+    # Arrange
+    mock_db, _ = _make_mock_db()
+    in_flight = set()
+    max_in_flight = 0
+    contexts = {}
+
+    async def side_effect(section_type, context_data, student_name):
+        nonlocal max_in_flight
+        in_flight.add(section_type)
+        max_in_flight = max(max_in_flight, len(in_flight))
+        contexts[section_type] = context_data
+        await asyncio.sleep(0)
+        in_flight.discard(section_type)
+        return f"<p>Seção {section_type}</p>"
+
+    with patch("app.services.report_service.generate_report_section", new_callable=AsyncMock) as mock_generate_section:
+        mock_generate_section.side_effect = side_effect
+
+        # Act
+        await create_report_for_student(str(STUDENT_ID), mock_db)
+
+    # Assert
+    assert max_in_flight == 4
+    for pillar in ("overview", "nutrition_analysis", "sleep_analysis", "training_analysis"):
+        assert f"<p>Seção {pillar}</p>" in contexts["detailed_insights"]
+    assert "<p>Seção detailed_insights</p>" in contexts["conclusion"]
+
+@pytest.mark.asyncio
+async def test_create_report_student_not_found():
+    """
+    Tests that a missing student raises a 404 once the concurrent fetches complete.
+    """
+    # Arrange
+    mock_db, mock_relatorios_collection = _make_mock_db()
+    collections = {name: mock_db[name] for name in ("students", "checkins", "macro_goals", "relatorios")}
+    collections["students"].find_one.return_value = None
+    mock_db.__getitem__.side_effect = collections.__getitem__
+
+    # Act & Assert
+    with pytest.raises(HTTPException) as exc_info:
+        await create_report_for_student(str(STUDENT_ID), mock_db)
+    assert exc_info.value.status_code == 404
+    mock_relatorios_collection.insert_one.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_bulk_reports_respect_concurrency_limit(monkeypatch):
+    """
+    Tests that bulk generation never runs more than BULK_CONCURRENCY reports at the same time.
+    """
+    # Arrange
+    monkeypatch.setattr(settings, 'BULK_CONCURRENCY', 2)
+    students = [{"_id": ObjectId(), "full_name": f"Aluno {i}"} for i in range(6)]
+    mock_db = MagicMock()
+    mock_db.__getitem__.return_value.find.return_value.to_list = AsyncMock(return_value=students)
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_create_report(student_id, db):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return "<html></html>"
+
+    with patch("app.services.report_service.create_report_for_student", side_effect=fake_create_report) as mock_create:
+        # Act
+        await generate_bulk_reports(mock_db)
+
+    # Assert
+    assert mock_create.call_count == len(students)
+    assert max_in_flight == 2
 
-    # Mock the file system read for the template
-    with patch("builtins.open", new_callable=MagicMock) as mock_open:
-        mock_open.return_value.__enter__.return_value.read.return_value = IDEAL_TEMPLATE_CONTENT
-        
-        # Mock the specialist agent to return different content based on the section
-        async def side_effect(section_type, context_data):
-            if section_type == "overview":
-                return "Este é o resumo da visão geral gerado pelo LLM."
-            elif section_type == "nutrition_analysis":
-                return "<p>Insights de nutrição gerados pelo LLM.</p>"
-            elif section_type == "sleep_analysis":
-                return "<p>Insights de sono gerados pelo LLM.</p>"
-            elif section_type == "training_analysis":
-                return "<p>Insights de treino gerados pelo LLM.</p>"
-            elif section_type == "detailed_insights":
-                return "<p>Insights detalhados gerados pelo LLM.</p>"
-            elif section_type == "recommendations":
-                return "<p>Recomendações geradas pelo LLM.</p>"
-            elif section_type == "conclusion":
-                return "<p>Conclusão gerada pelo LLM.</p>"
-            return ""
-        
-        with patch("app.services.report_service.generate_report_section", new_callable=AsyncMock) as mock_generate_section:
-            mock_generate_section.side_effect = side_effect
-
-            # Act
-            final_html = await create_report_for_student(str(STUDENT_ID), mock_db)
-
-            # Assert
-            # 1. Check that the correct agents were called
-            assert mock_generate_section.call_count == 7
-            assert mock_generate_section.call_args_list[0].args[0] == "overview"
-            assert mock_generate_section.call_args_list[1].args[0] == "nutrition_analysis"
-            assert mock_generate_section.call_args_list[2].args[0] == "sleep_analysis"
-            assert mock_generate_section.call_args_list[3].args[0] == "training_analysis"
-            assert mock_generate_section.call_args_list[4].args[0] == "detailed_insights"
-            assert mock_generate_section.call_args_list[5].args[0] == "recommendations"
-            assert mock_generate_section.call_args_list[6].args[0] == "conclusion"
-
-            # 2. Check that the template was populated correctly
-            assert "<p>Conclusão gerada pelo LLM.</p>" in final_html
-            
-            # 3. Check that no sections are placeholder comments
-            assert "<!--" not in final_html
-            
-            # 4. Check that the report was saved
-            mock_relatorios_collection.insert_one.assert_called_once()
+@pytest.mark.asyncio
+async def test_create_report_invalid_student_id():
+    """
+    Tests that a malformed student ID is rejected with a 400 before any query is made.
+    """
+    mock_db, _ = _make_mock_db()
+
+    with pytest.raises(HTTPException) as exc_info:
+        await create_report_for_student("not-an-object-id", mock_db)
+    assert exc_info.value.status_code == 400
+    mock_db.__getitem__.assert_not_called()
+
+def test_parse_previous_week_data_extracts_metric_cards():
+    """
+    Tests that the previous week's metrics are read once from the metric cards of the last report
+    and feed both the prompt context and the nutrition comparison.
+    """
+    previous_html = """
+    <div class="metric-item">
+        <div class="metric-label">Calorias Médias</div>
+        <div class="metric-value">2100 kcal</div>
+    </div>
+    <div class="metric-item">
+        <div class="metric-label">Proteína Média</div>
+        <div class="metric-value">150g</div>
+    </div>"""
+
+    previous_report_metrics = report_service._parse_previous_report([{"html_content": previous_html}])
+
+    assert report_service._parse_previous_week_data(previous_report_metrics) == "Calorias médias: 2100 kcal\nProteína média: 150g\nVolume treino: N/A"
+    assert report_service._parse_previous_week_metrics(previous_report_metrics) == {"calories": 2100.0, "protein": 150.0}
+
+def test_parse_previous_report_prefers_stored_metrics():
+    """
+    Tests that the numeric metrics saved with the last report are used without parsing its HTML.
+    """
+    past_reports = [{"html_content": "<div>sem cards</div>", "metrics": {"calories": 1980.4, "protein": 142.0, "total_sets": 38}}]
+
+    previous_report_metrics = report_service._parse_previous_report(past_reports)
+
+    assert report_service._parse_previous_week_data(previous_report_metrics) == "Calorias médias: 1980 kcal\nProteína média: 142g\nVolume treino: ~38 séries"
+    assert report_service._parse_previous_week_metrics(previous_report_metrics) == {"calories": 1980.4, "protein": 142.0}
+
+def test_nutrition_metric_grids_show_computed_percentages():
+    """
+    Tests that the macro shares and the protein adherence are rendered as numbers instead of raw template expressions.
+    """
+    main_grid = report_service._build_main_metrics_grid(2000, 150, 250, 60, 160, {})
+    consistency_grid = report_service._build_consistency_metrics_grid(4.2, 5, 7)
+
+    assert "50% das calorias totais" in main_grid
+    assert "27% das calorias totais" in main_grid
+    assert "71% de aderência" in consistency_grid
+    assert "{" not in main_grid + consistency_grid
+
+@pytest.mark.asyncio
+async def test_create_report_reuses_report_with_unchanged_inputs():
+    """
+    Tests that when the latest report was generated from the same inputs on the same day, it is returned
+    without calling the LLM or saving a duplicate report, and that it is generated again on a later day.
+    """
+    # Arrange
+    mock_db, mock_relatorios_collection = _make_mock_db()
+
+    with patch("app.services.report_service.generate_report_section", new_callable=AsyncMock) as mock_generate_section:
+        mock_generate_section.return_value = "<p>Seção gerada pelo LLM.</p>"
+        first_html = await create_report_for_student(str(STUDENT_ID), mock_db)
+        saved_report = mock_relatorios_collection.insert_one.call_args.args[0]
+
+        # The saved report is now the latest one for the student; its HTML is only fetched because it is reused
+        latest_report = {"_id": ObjectId(), "input_hash": saved_report["input_hash"], "metrics": saved_report["metrics"]}
+        mock_relatorios_collection.find.return_value.sort.return_value.limit.return_value.to_list.return_value = [latest_report]
+        mock_relatorios_collection.find_one = AsyncMock(return_value={"html_content": saved_report["html_content"]})
+        mock_generate_section.reset_mock()
+        mock_relatorios_collection.insert_one.reset_mock()
+
+        # Act
+        second_html = await create_report_for_student(str(STUDENT_ID), mock_db)
+
+    # Assert
+    assert second_html == first_html
+    mock_generate_section.assert_not_called()
+    mock_relatorios_collection.insert_one.assert_not_called()
+    mock_relatorios_collection.find_one.assert_awaited_once_with({"_id": latest_report["_id"]}, report_service.PAST_REPORT_HTML_PROJECTION)
+
+    # A day later the same inputs cover a different date range, so the stored report is not served again
+    next_day = datetime.now(timezone(timedelta(hours=-3))) + timedelta(days=1)
+    with patch("app.services.report_service.generate_report_section", new_callable=AsyncMock) as mock_generate_section, \
+         patch("app.services.report_service.datetime", wraps=datetime) as mock_datetime:
+        mock_generate_section.return_value = "<p>Seção gerada pelo LLM.</p>"
+        mock_datetime.now.return_value = next_day
+        await create_report_for_student(str(STUDENT_ID), mock_db)
+
+    assert mock_generate_section.call_count == 7
+    mock_relatorios_collection.insert_one.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_create_report_regenerates_when_reused_html_is_missing():
+    """
+    Tests that a matching input hash is not reused when the stored report HTML can no longer be fetched.
+    """
+    # Arrange
+    mock_db, mock_relatorios_collection = _make_mock_db()
+
+    with patch("app.services.report_service.generate_report_section", new_callable=AsyncMock) as mock_generate_section:
+        mock_generate_section.return_value = "<p>Seção gerada pelo LLM.</p>"
+        await create_report_for_student(str(STUDENT_ID), mock_db)
+        saved_report = mock_relatorios_collection.insert_one.call_args.args[0]
+
+        latest_report = {"_id": ObjectId(), "input_hash": saved_report["input_hash"], "metrics": saved_report["metrics"]}
+        mock_relatorios_collection.find.return_value.sort.return_value.limit.return_value.to_list.return_value = [latest_report]
+        mock_relatorios_collection.find_one = AsyncMock(return_value=None)
+        mock_generate_section.reset_mock()
+
+        # Act
+        second_html = await create_report_for_student(str(STUDENT_ID), mock_db)
+
+    # Assert
+    assert second_html.startswith("<!DOCTYPE html>")
+    assert mock_generate_section.call_count == 7
+
+@pytest.mark.asyncio
+async def test_report_with_failed_section_is_not_reused():
+    """
+    Tests that a report containing a section that failed to generate is saved without its input hash,
+    so the next request with the same inputs calls the LLM again instead of serving the error.
+    """
+    # Arrange
+    mock_db, mock_relatorios_collection = _make_mock_db()
+
+    async def side_effect(section_type, context_data, student_name):
+        if section_type == "recommendations":
+            return section_error_html(section_type)
+        return SECTION_RESPONSES[section_type]
+
+    with patch("app.services.report_service.generate_report_section", new_callable=AsyncMock) as mock_generate_section:
+        mock_generate_section.side_effect = side_effect
+        await create_report_for_student(str(STUDENT_ID), mock_db)
+        saved_report = mock_relatorios_collection.insert_one.call_args.args[0]
+
+        latest_report = {"_id": ObjectId(), "input_hash": saved_report["input_hash"], "metrics": saved_report["metrics"]}
+        mock_relatorios_collection.find.return_value.sort.return_value.limit.return_value.to_list.return_value = [latest_report]
+        mock_generate_section.reset_mock()
+
+        # Act
+        await create_report_for_student(str(STUDENT_ID), mock_db)
+
+    # Assert
+    assert saved_report["input_hash"] is None
+    assert mock_generate_section.call_count == 7
+
+def test_report_input_hash_changes_with_prompts_and_template():
+    """
+    Tests that editing a section prompt or the report template changes the input hash,
+    so reports generated from the old instructions are not reused.
+    """
+    end_date = datetime(2025, 11, 1, tzinfo=UTC)
+    hash_args = (STUDENT_ID, end_date, STUDENT_DATA, [SAMPLE_CHECKIN], SAMPLE_MACRO_GOALS, 4)
+
+    with patch("app.services.report_service.prompts_digest", return_value="prompts v1"):
+        original_hash = report_service._report_input_hash(*hash_args)
+    with patch("app.services.report_service.prompts_digest", return_value="prompts v2"):
+        edited_prompts_hash = report_service._report_input_hash(*hash_args)
+    with patch("app.services.report_service.prompts_digest", return_value="prompts v1"), \
+         patch("app.services.report_service._load_report_template", return_value=("<html>novo</html>",)):
+        edited_template_hash = report_service._report_input_hash(*hash_args)
+
+    assert len({original_hash, edited_prompts_hash, edited_template_hash}) == 3
+
+def test_format_journal_exercises_lists_sets_under_each_exercise():
+    """
+    Tests that each exercise name is rendered before its own sets and that Hevy links are dropped.
+    """
+    lines = ["Supino Reto", "Série 1: 80kg x 8", "Série 2: 80kg x 8", "", "Crucifixo", "Série 1: 20kg x 12", "@hevyapp"]
+
+    result = report_service._format_journal_exercises(lines)
+
+    assert result == (
+        "<strong>Supino Reto</strong><br>• Série 1: 80kg x 8<br>• Série 2: 80kg x 8<br>"
+        "<strong>Crucifixo</strong><br>• Série 1: 20kg x 12<br>"
+    )
+
+def test_checkin_day_labels_are_portuguese_regardless_of_locale():
+    """
+    Tests that weekday and month names come from the Portuguese tables instead of the process locale.
+    """
+    assert report_service._format_checkin_day("2025-10-20") == "20/10 (Seg)"
+    assert report_service._format_checkin_day("2025-10-25") == "25/10 (Sáb)"
+    dates = report_service._report_dates(datetime(2025, 10, 18), datetime(2025, 10, 25), datetime(2025, 9, 13))
+    assert dates["month_pt"] == "Outubro"